@@ -1,133 +1,26 @@
-from flask import Flask, request, abort
-import json
-from functools import wraps
-from jose import jwt
-from urllib.request import urlopen
+from flask import Flask
+from fsnd_auth import Auth, JWKSKeyProvider
 
 
 app = Flask(__name__)
 
 AUTH0_DOMAIN = 'bjb.auth0.com'
-ALGORITHMS = ['RS256']
 API_AUDIENCE = 'udacity-fsnd-image'
 
+# Header parsing, JWKS key caching, verified token caching and permission
+# checks come from the shared fsnd_auth package at the repository root
+auth = Auth(JWKSKeyProvider.for_auth0(AUTH0_DOMAIN), API_AUDIENCE,
+            issuer='https://' + AUTH0_DOMAIN + '/')
+auth.register_error_handler(app)
 
-class AuthError(Exception):
-    def __init__(self, error, status_code):
-        self.error = error
-        self.status_code = status_code
-
-
-def get_token_auth_header():
-    """Obtains the Access Token from the Authorization Header
-    """
-    auth = request.headers.get('Authorization', None)
-    if not auth:
-        raise AuthError({
-            'code': 'authorization_header_missing',
-            'description': 'Authorization header is expected.'
-        }, 401)
-
-    parts = auth.split()
-    if parts[0].lower() != 'bearer':
-        raise AuthError({
-            'code': 'invalid_header',
-            'description': 'Authorization header must start with "Bearer".'
-        }, 401)
-
-    elif len(parts) == 1:
-        raise AuthError({
-            'code': 'invalid_header',
-            'description': 'Token not found.'
-        }, 401)
-
-    elif len(parts) > 2:
-        raise AuthError({
-            'code': 'invalid_header',
-            'description': 'Authorization header must be bearer token.'
-        }, 401)
-
-    token = parts[1]
-    return token
-
-
-def verify_decode_jwt(token):
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
-    unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
-    if 'kid' not in unverified_header:
-        raise AuthError({
-            'code': 'invalid_header',
-            'description': 'Authorization malformed.'
-        }, 401)
-
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
-    if rsa_key:
-        try:
-            payload = jwt.decode(
-                token,
-                rsa_key,
-                algorithms=ALGORITHMS,
-                audience=API_AUDIENCE,
-                issuer='https://' + AUTH0_DOMAIN + '/'
-            )
-
-            return payload
-
-        except jwt.ExpiredSignatureError:
-            raise AuthError({
-                'code': 'token_expired',
-                'description': 'Token expired.'
-            }, 401)
-
-        except jwt.JWTClaimsError:
-            raise AuthError({
-                'code': 'invalid_claims',
-                'description': 'Incorrect claims. Please, check the audience and issuer.'
-            }, 401)
-        except Exception:
-            raise AuthError({
-                'code': 'invalid_header',
-                'description': 'Unable to parse authentication token.'
-            }, 400)
-    raise AuthError({
-                'code': 'invalid_header',
-                'description': 'Unable to find the appropriate key.'
-            }, 400)
-
-def check_permissions(permission, payload):
-    if 'permissions' not in payload:
-        abort(400) # No permissions component to payload
-    if permission not in payload['permissions']:
-        abort(403) # We know who you are, but you are denied
-    return True    
-
-def requires_auth(permission=''):
-    def requires_auth_decorator(f):
-        @wraps(f)
-        def wrapper(*args, **kwargs):
-            token = get_token_auth_header()
-            try:
-                payload = verify_decode_jwt(token)
-            except:
-                abort(401)
-            check_permissions(permission, payload)
-
-            return f(payload, *args, **kwargs)
-        return wrapper
-    return requires_auth_decorator
+get_token_auth_header = auth.get_token_auth_header
+verify_decode_jwt = auth.verify_decode_jwt
+check_permissions = auth.check_permissions
+requires_auth = auth.requires_auth
+token_cache = auth.token_cache
 
 # @app.route('/headers')
-# @requires_auth
+# @requires_auth()
 # def headers(payload):
 #     print(payload)
 #     return 'Access Granted'
@@ -136,4 +29,4 @@ def requires_auth(permission=''):
 @requires_auth('get:images')
 def images(jwt):
     print(jwt)
-    return 'Show Image'
\ No newline at end of file
+    return 'Show Image'
@@ -0,0 +1,23 @@
+'''
+Shared authentication for the Flask services in this repository: bearer
+token parsing, JWT verification against pluggable key providers, cached
+verified tokens and compiled permission sets, and per-step timings.
+'''
+from .auth import Auth
+from .cache import TokenCache
+from .errors import AuthError
+from .keys import JWKSKeyProvider, PEMKeyProvider, SecretKeyProvider
+from .metrics import StepTimings
+from .permissions import PermissionSet, matching_grants
+
+__all__ = [
+    'Auth',
+    'AuthError',
+    'JWKSKeyProvider',
+    'PEMKeyProvider',
+    'PermissionSet',
+    'SecretKeyProvider',
+    'StepTimings',
+    'TokenCache',
+    'matching_grants',
+]
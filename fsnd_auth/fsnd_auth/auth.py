@@ -0,0 +1,205 @@
+'''
+Auth
+    the request side of authentication for a Flask service: reads the
+    bearer token, verifies it with a key provider, checks the permissions
+    claim and passes the payload to the view.
+
+    auth = Auth(JWKSKeyProvider.for_auth0(domain), audience,
+                issuer='https://%s/' % domain)
+
+    @app.route('/drinks-detail')
+    @auth.requires_auth('get:drinks-detail')
+    def drinks_detail(payload):
+        ...
+
+Every failure raises AuthError with a 401, except missing or insufficient
+permissions (forbidden_status, 403 by default) and an unreachable key
+source (503). Verified tokens are kept in token_cache until they expire,
+and each step is timed into timings; stats() returns both.
+'''
+from copy import deepcopy
+from functools import wraps
+from time import perf_counter
+
+from flask import jsonify, request
+from jose import jwt
+
+from .cache import TokenCache
+from .errors import AuthError
+from .metrics import StepTimings
+from .permissions import PermissionSet
+
+
+class Auth:
+    def __init__(self, keys, audience, issuer=None, forbidden_status=403,
+                 token_cache=None, timings=None):
+        self.keys = keys
+        self.audience = audience
+        self.issuer = issuer
+        self.forbidden_status = forbidden_status
+        self.token_cache = token_cache if token_cache is not None \
+            else TokenCache()
+        self.timings = timings if timings is not None else StepTimings()
+
+    def get_token_auth_header(self):
+        '''Obtains the Access Token from the Authorization Header'''
+        auth = request.headers.get('Authorization', None)
+        parts = auth.split() if auth else []
+        if not parts:
+            raise AuthError({
+                'code': 'authorization_header_missing',
+                'description': 'Authorization header is expected.'
+            }, 401)
+        if parts[0].lower() != 'bearer':
+            raise AuthError({
+                'code': 'invalid_header',
+                'description': 'Authorization header must start with "Bearer".'
+            }, 401)
+        elif len(parts) == 1:
+            raise AuthError({
+                'code': 'invalid_header',
+                'description': 'Token not found.'
+            }, 401)
+        elif len(parts) > 2:
+            raise AuthError({
+                'code': 'invalid_header',
+                'description': 'Authorization header must be bearer token.'
+            }, 401)
+        return parts[1]
+
+    def verify_decode_jwt(self, token):
+        '''Verifies the signature and claims of token; returns its payload'''
+        started = perf_counter()
+        try:
+            unverified_header = jwt.get_unverified_header(token)
+        except Exception:
+            raise AuthError({
+                'code': 'invalid_header',
+                'description': 'Unable to parse authentication token.'
+            }, 401)
+        kid = unverified_header.get('kid')
+        if kid is None and self.keys.requires_kid:
+            raise AuthError({
+                'code': 'invalid_header',
+                'description': 'Authorization malformed.'
+            }, 401)
+        key = self.keys.get_key(kid)
+        keyed = perf_counter()
+        self.timings.add('key', keyed - started)
+        if not key:
+            raise AuthError({
+                'code': 'invalid_header',
+                'description': 'Unable to find the appropriate key.'
+            }, 401)
+        try:
+            return jwt.decode(
+                token,
+                key,
+                algorithms=self.keys.algorithms,
+                audience=self.audience,
+                issuer=self.issuer
+            )
+        except jwt.ExpiredSignatureError:
+            raise AuthError({
+                'code': 'token_expired',
+                'description': 'Token expired.'
+            }, 401)
+        except jwt.JWTClaimsError:
+            raise AuthError({
+                'code': 'invalid_claims',
+                'description': 'Incorrect claims. Please, check the audience and issuer.'
+            }, 401)
+        except Exception:
+            raise AuthError({
+                'code': 'invalid_header',
+                'description': 'Unable to parse authentication token.'
+            }, 401)
+        finally:
+            self.timings.add('decode', perf_counter() - keyed)
+
+    def authenticate(self, token):
+        '''
+        Returns (payload, PermissionSet) for token, from the token cache
+        when it was verified before. The payload is a copy, so a view
+        changing it does not change what later requests see.
+        '''
+        started = perf_counter()
+        cached = self.token_cache.get(token)
+        self.timings.add('cache', perf_counter() - started)
+        if cached is not None:
+            payload, granted = cached
+            return deepcopy(payload), granted
+        payload = self.verify_decode_jwt(token)
+        granted = PermissionSet.from_payload(payload)
+        self.token_cache.put(token, payload, granted)
+        return deepcopy(payload), granted
+
+    def check_permissions(self, permission, payload, any_of=None,
+                          granted=None):
+        '''
+        permission is one permission or a list of permissions that are all
+        required; any_of, if given, lists permissions of which one is
+        required. granted is the PermissionSet compiled from payload, if
+        already at hand.
+        '''
+        if 'permissions' not in payload:
+            raise AuthError({
+                'code': 'no_permissions',
+                'description': 'No permissions component to payload.'
+            }, self.forbidden_status)
+        if granted is None:
+            granted = PermissionSet.from_payload(payload)
+        all_of = [permission] if isinstance(permission, str) else permission
+        if not granted.has_all(p for p in all_of if p) or (
+                any_of and not granted.has_any(any_of)):
+            raise AuthError({
+                'code': 'insufficient_permissions',
+                'description': 'User does not have permissions to take that action.'
+            }, self.forbidden_status)
+        return True
+
+    def requires_auth(self, permission='', all_of=(), any_of=()):
+        '''
+        Decorator passing the verified payload to the view as its first
+        argument, once the token grants permission, every permission in
+        all_of and at least one of any_of (when given)
+        '''
+        required = [permission] + list(all_of)
+
+        def requires_auth_decorator(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                started = perf_counter()
+                try:
+                    try:
+                        token = self.get_token_auth_header()
+                    finally:
+                        self.timings.add('header', perf_counter() - started)
+                    payload, granted = self.authenticate(token)
+                    checked = perf_counter()
+                    try:
+                        self.check_permissions(
+                            required, payload, any_of, granted)
+                    finally:
+                        self.timings.add('permissions',
+                                         perf_counter() - checked)
+                finally:
+                    self.timings.add('total', perf_counter() - started)
+                return f(payload, *args, **kwargs)
+            return wrapper
+        return requires_auth_decorator
+
+    def register_error_handler(self, app):
+        '''Makes app answer AuthError with its error dict as JSON'''
+        @app.errorhandler(AuthError)
+        def handle_auth_error(ex):
+            response = jsonify(ex.error)
+            response.status_code = ex.status_code
+            return response
+
+    def stats(self):
+        return {
+            'keys': self.keys.stats(),
+            'tokens': self.token_cache.stats(),
+            'timings': self.timings.stats()
+        }
@@ -0,0 +1,58 @@
+'''
+TokenCache
+    bounded LRU of verified payloads and their compiled PermissionSet,
+    keyed by the SHA-256 of the token.
+    An entry lives until the token's exp (at most max_ttl seconds), so a
+    client resending the same bearer token skips the signature
+    verification and claims check. hits/misses (see stats()) show how
+    often that is.
+'''
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenCache:
+    def __init__(self, max_entries=10000, max_ttl=3600):
+        self.max_entries = max_entries
+        self.max_ttl = max_ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # token hash -> (expires at, payload, permissions)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token):
+        # Hash the token so that the cache never holds usable credentials
+        return hashlib.sha256(token.encode('utf-8')).digest()
+
+    def get(self, token):
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1:]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, token, payload, permissions):
+        expires_at = min(payload.get('exp', float('inf')),
+                         time.time() + self.max_ttl)
+        with self._lock:
+            self._entries[self._key(token)] = (
+                expires_at, payload, permissions)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self._entries)}
@@ -0,0 +1,11 @@
+'''
+AuthError
+A standardized way to communicate auth failure modes: error is a dict with
+a machine readable code and a description, status_code the HTTP status.
+'''
+
+
+class AuthError(Exception):
+    def __init__(self, error, status_code):
+        self.error = error
+        self.status_code = status_code
@@ -0,0 +1,218 @@
+'''
+Key providers: where the key that verifies a token's signature comes from.
+
+    JWKSKeyProvider    RS256 keys published at a JWKS url (Auth0)
+    PEMKeyProvider     an RS256 public key or certificate in a local file
+    SecretKeyProvider  an HS256 shared secret
+
+A provider has `algorithms`, `requires_kid` and get_key(kid), which returns
+a key python-jose can verify with, or None when kid is unknown.
+'''
+import json
+import os
+import random
+import re
+import threading
+import time
+from urllib.request import urlopen
+
+from .errors import AuthError
+
+
+class JWKSKeyProvider:
+    '''
+    Caches the signing keys published at a JWKS url, indexed by kid
+    - keys are kept for the response's Cache-Control max-age (clamped to
+      [min_ttl, max_ttl], default_ttl without one) and refreshed by a
+      background thread shortly before they expire, with random jitter so
+      that several workers do not refetch in step
+    - an unknown kid triggers one refetch, shared by every request waiting
+      on it (single flight) and at most once per unknown_kid_interval, so
+      a flood of bogus tokens cannot hammer the JWKS endpoint
+    - if the endpoint is down, the last keys keep being served for up to
+      max_stale seconds past their expiry
+    '''
+    KEY_FIELDS = ('kty', 'kid', 'use', 'n', 'e')
+    algorithms = ['RS256']
+    requires_kid = True
+
+    def __init__(self, url, default_ttl=600, min_ttl=60, max_ttl=86400,
+                 max_stale=86400, unknown_kid_interval=30, jitter=0.1,
+                 retry_interval=30, timeout=5):
+        self.url = url
+        self.default_ttl = default_ttl
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.max_stale = max_stale
+        self.unknown_kid_interval = unknown_kid_interval
+        self.jitter = jitter
+        self.retry_interval = retry_interval
+        self.timeout = timeout
+        self.fetches = 0
+        self._keys = {}
+        self._fetched_at = 0
+        self._expires_at = 0
+        self._fetch_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._refresher = None
+
+    @classmethod
+    def for_auth0(cls, domain, **options):
+        return cls('https://%s/.well-known/jwks.json' % domain, **options)
+
+    def get_key(self, kid):
+        '''
+        Returns the JWK for kid, or None when the endpoint does not list it.
+        Raises AuthError when no keys could ever be fetched, or when the
+        endpoint has been down for more than max_stale seconds past the
+        expiry of the last keys.
+        '''
+        now = time.time()
+        key = self._keys.get(kid)
+        if key is not None and now < self._expires_at + self.max_stale:
+            return key
+        if now - self._fetched_at >= self.unknown_kid_interval:
+            self._refetch(self._fetched_at)
+        if time.time() >= self._expires_at + self.max_stale:
+            raise AuthError({
+                'code': 'jwks_unavailable',
+                'description': 'Unable to fetch the signing keys.'
+            }, 503)
+        return self._keys.get(kid)
+
+    def _refetch(self, seen_fetched_at):
+        # Single flight: whoever gets the lock fetches; the others wait and
+        # then find _fetched_at moved on and reuse that result
+        with self._fetch_lock:
+            if self._fetched_at != seen_fetched_at:
+                return
+            try:
+                self.fetch()
+            except Exception:
+                if not self._keys:
+                    raise AuthError({
+                        'code': 'jwks_unavailable',
+                        'description': 'Unable to fetch the signing keys.'
+                    }, 503)
+                # Keep serving the keys we have; wait before trying again
+                self._fetched_at = time.time()
+
+    def fetch(self):
+        with urlopen(self.url, timeout=self.timeout) as response:
+            jwks = json.loads(response.read())
+            cache_control = response.headers.get('Cache-Control') or ''
+        max_age = re.search(r'max-age=(\d+)', cache_control)
+        ttl = int(max_age.group(1)) if max_age else self.default_ttl
+        ttl = min(max(ttl, self.min_ttl), self.max_ttl)
+        self._keys = dict(
+            (key['kid'], dict((field, key[field])
+                              for field in self.KEY_FIELDS if field in key))
+            for key in jwks['keys'] if 'kid' in key)
+        now = time.time()
+        self._fetched_at, self._expires_at = now, now + ttl
+        self.fetches += 1
+        self._start_refresher()
+
+    def _start_refresher(self):
+        if self._refresher is None and not self._stopped.is_set():
+            self._refresher = threading.Thread(
+                target=self._refresh_loop, name='jwks-refresh', daemon=True)
+            self._refresher.start()
+
+    def _refresh_loop(self):
+        delay = self._next_refresh_delay()
+        while not self._stopped.wait(delay):
+            try:
+                with self._fetch_lock:
+                    self.fetch()
+                delay = self._next_refresh_delay()
+            except Exception:
+                delay = self.retry_interval * random.uniform(1, 1 + self.jitter)
+
+    def _next_refresh_delay(self):
+        # Refresh a random moment within the last `jitter` share of the ttl
+        ttl = self._expires_at - self._fetched_at
+        return max(ttl * (1 - random.uniform(0, self.jitter)) -
+                   (time.time() - self._fetched_at), 1)
+
+    def stats(self):
+        return {'provider': 'jwks', 'keys': len(self._keys),
+                'fetches': self.fetches}
+
+    def close(self):
+        # Stops the background refresh
+        self._stopped.set()
+
+
+class PEMKeyProvider:
+    '''
+    An RS256 public key (or certificate) read from a PEM file. The file is
+    read on first use and again only when its modification time changes,
+    checked at most every check_interval seconds, so keys can be rotated
+    by replacing the file. kid, if given, is the only key id accepted.
+    '''
+    requires_kid = False
+
+    def __init__(self, path, kid=None, algorithms=('RS256',),
+                 check_interval=60):
+        self.path = path
+        self.kid = kid
+        self.algorithms = list(algorithms)
+        self.check_interval = check_interval
+        self.loads = 0
+        self._key = None
+        self._mtime = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    def get_key(self, kid):
+        if self.kid is not None and kid != self.kid:
+            return None
+        if time.time() - self._checked_at >= self.check_interval:
+            self._reload()
+        return self._key
+
+    def _reload(self):
+        with self._lock:
+            self._checked_at = time.time()
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except OSError:
+                if self._key is None:
+                    raise AuthError({
+                        'code': 'key_unavailable',
+                        'description': 'Unable to read the signing key.'
+                    }, 503)
+                return
+            if mtime != self._mtime:
+                with open(self.path) as f:
+                    self._key = f.read()
+                self._mtime = mtime
+                self.loads += 1
+
+    def stats(self):
+        return {'provider': 'pem', 'keys': int(self._key is not None),
+                'loads': self.loads}
+
+
+class SecretKeyProvider:
+    '''
+    An HS256 shared secret, for services that mint their own tokens and
+    for tests. kid, if given, is the only key id accepted.
+    '''
+    requires_kid = False
+
+    def __init__(self, secret, kid=None, algorithms=('HS256',)):
+        if not secret:
+            raise ValueError('An empty secret would accept forged tokens')
+        self.secret = secret
+        self.kid = kid
+        self.algorithms = list(algorithms)
+
+    def get_key(self, kid):
+        if self.kid is not None and kid != self.kid:
+            return None
+        return self.secret
+
+    def stats(self):
+        return {'provider': 'secret', 'keys': 1}
@@ -0,0 +1,37 @@
+'''
+StepTimings
+    count, total and worst time of each step of the auth hot path
+    ('header', 'cache', 'key', 'decode', 'permissions', 'total'), so the
+    cost of authentication can be read per service without a profiler.
+'''
+import threading
+
+
+class StepTimings:
+    def __init__(self):
+        self._steps = {}  # step -> [count, total seconds, max seconds]
+        self._lock = threading.Lock()
+
+    def add(self, step, seconds):
+        with self._lock:
+            entry = self._steps.get(step)
+            if entry is None:
+                self._steps[step] = [1, seconds, seconds]
+            else:
+                entry[0] += 1
+                entry[1] += seconds
+                if seconds > entry[2]:
+                    entry[2] = seconds
+
+    def reset(self):
+        with self._lock:
+            self._steps.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict((step, {
+                'count': count,
+                'total_ms': round(total * 1e3, 3),
+                'mean_us': round(total / count * 1e6, 1),
+                'max_us': round(worst * 1e6, 1)
+            }) for step, (count, total, worst) in self._steps.items())
@@ -0,0 +1,43 @@
+'''
+PermissionSet
+    the permissions claim of a verified payload, compiled once into a
+    frozenset and cached with the token. A '*' segment in a granted
+    permission matches any one segment, and a trailing '*' matches the
+    rest: '*:drinks' grants every action on drinks, 'drinks:*' grants
+    'drinks:read' and 'drinks:recipe:edit', and '*' grants everything.
+    A check looks up the few grants that could match the required
+    permission, so its cost does not depend on the length of the list.
+'''
+from functools import lru_cache
+
+
+@lru_cache(maxsize=1024)
+def matching_grants(permission):
+    '''Every granted permission that satisfies the required one'''
+    segments = permission.split(':')
+    grants = [permission]
+    prefixes = [()]
+    for segment in segments:
+        grants.extend(':'.join(prefix + ('*',)) for prefix in prefixes)
+        prefixes = [prefix + (option,)
+                    for prefix in prefixes for option in (segment, '*')]
+    grants.extend(':'.join(prefix) for prefix in prefixes)
+    return frozenset(grants)
+
+
+class PermissionSet:
+    def __init__(self, permissions):
+        self.grants = frozenset(permissions)
+
+    @classmethod
+    def from_payload(cls, payload):
+        return cls(payload.get('permissions') or ())
+
+    def has(self, permission):
+        return not self.grants.isdisjoint(matching_grants(permission))
+
+    def has_all(self, permissions):
+        return all(self.has(permission) for permission in permissions)
+
+    def has_any(self, permissions):
+        return any(self.has(permission) for permission in permissions)
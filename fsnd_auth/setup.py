@@ -0,0 +1,14 @@
+from setuptools import setup
+
+setup(
+    name='fsnd-auth',
+    version='0.1.0',
+    description='Shared JWT authentication for the FSND Flask services',
+    packages=['fsnd_auth'],
+    python_requires='>=3.6',
+    # The services pin their own `jose` distribution (python-jose or
+    # python-jose-cryptodome); both install the same package, so it is
+    # left to them rather than required here
+    install_requires=['Flask'],
+    extras_require={'jose': ['python-jose']},
+)
@@ -0,0 +1,358 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from flask import Flask
+from jose import jwt
+
+from fsnd_auth import (Auth, AuthError, JWKSKeyProvider, PEMKeyProvider,
+                       PermissionSet, SecretKeyProvider, TokenCache,
+                       matching_grants)
+
+SECRET = 'test-secret'
+AUDIENCE = 'fsnd'
+ISSUER = 'https://fsnd.test/'
+
+
+def make_token(permissions=None, key=SECRET, algorithm='HS256', kid=None,
+               **claims):
+    payload = {'sub': 'user', 'aud': AUDIENCE, 'iss': ISSUER,
+               'exp': time.time() + 600}
+    if permissions is not None:
+        payload['permissions'] = permissions
+    payload.update(claims)
+    headers = {'kid': kid} if kid is not None else None
+    return jwt.encode(payload, key, algorithm=algorithm, headers=headers)
+
+
+class AuthTestCase(unittest.TestCase):
+    """This class represents the shared auth test case"""
+
+    def setUp(self):
+        self.auth = Auth(SecretKeyProvider(SECRET), AUDIENCE, issuer=ISSUER)
+        self.app = Flask(__name__)
+        self.auth.register_error_handler(self.app)
+
+        @self.app.route('/drinks')
+        @self.auth.requires_auth('get:drinks')
+        def drinks(payload):
+            return payload['sub']
+
+        @self.app.route('/manage')
+        @self.auth.requires_auth(all_of=['patch:drinks', 'delete:drinks'])
+        def manage(payload):
+            return 'managed'
+
+        @self.app.route('/menu')
+        @self.auth.requires_auth(any_of=['get:menu', 'get:drinks-detail'])
+        def menu(payload):
+            return 'menu'
+
+        self.client = self.app.test_client
+
+    def get(self, path, token):
+        return self.client().get(
+            path, headers={'Authorization': 'Bearer ' + token})
+
+    def test_valid_token(self):
+        res = self.get('/drinks', make_token(['get:drinks']))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data, b'user')
+
+    def test_401_without_authorization_header(self):
+        res = self.client().get('/drinks')
+
+        self.assertEqual(res.status_code, 401)
+        self.assertEqual(res.get_json()['code'],
+                         'authorization_header_missing')
+
+    def test_401_for_a_blank_authorization_header(self):
+        res = self.client().get('/drinks', headers={'Authorization': '   '})
+
+        self.assertEqual(res.status_code, 401)
+        self.assertEqual(res.get_json()['code'],
+                         'authorization_header_missing')
+
+    def test_401_for_a_bad_signature(self):
+        res = self.get('/drinks', make_token(['get:drinks'], key='other'))
+
+        self.assertEqual(res.status_code, 401)
+        self.assertEqual(res.get_json()['code'], 'invalid_header')
+
+    def test_401_for_an_expired_token(self):
+        res = self.get('/drinks', make_token(['get:drinks'],
+                                             exp=time.time() - 10))
+
+        self.assertEqual(res.status_code, 401)
+        self.assertEqual(res.get_json()['code'], 'token_expired')
+
+    def test_401_for_the_wrong_audience(self):
+        res = self.get('/drinks', make_token(['get:drinks'], aud='other'))
+
+        self.assertEqual(res.status_code, 401)
+        self.assertEqual(res.get_json()['code'], 'invalid_claims')
+
+    def test_403_for_missing_permission(self):
+        res = self.get('/drinks', make_token(['post:drinks']))
+
+        self.assertEqual(res.status_code, 403)
+        self.assertEqual(res.get_json()['code'], 'insufficient_permissions')
+
+    def test_forbidden_status_is_configurable(self):
+        self.auth.forbidden_status = 401
+        res = self.get('/drinks', make_token([]))
+
+        self.assertEqual(res.status_code, 401)
+
+    def test_403_without_permissions_claim(self):
+        res = self.get('/drinks', make_token())
+
+        self.assertEqual(res.status_code, 403)
+        self.assertEqual(res.get_json()['code'], 'no_permissions')
+
+    def test_all_of_and_any_of(self):
+        manager = make_token(['patch:drinks', 'delete:drinks'])
+        barista = make_token(['patch:drinks', 'get:drinks-detail'])
+
+        self.assertEqual(self.get('/manage', manager).status_code, 200)
+        self.assertEqual(self.get('/manage', barista).status_code, 403)
+        self.assertEqual(self.get('/menu', barista).status_code, 200)
+        self.assertEqual(self.get('/menu', manager).status_code, 403)
+
+    def test_wildcard_permissions(self):
+        granted = PermissionSet(['*:drinks', 'menu:*'])
+
+        self.assertTrue(granted.has('delete:drinks'))
+        self.assertTrue(granted.has('menu:items:edit'))
+        self.assertFalse(granted.has('get:menu'))
+        self.assertFalse(granted.has('delete:drinks:recipe'))
+        self.assertTrue(PermissionSet(['*']).has('anything:at:all'))
+
+    def test_matching_grants(self):
+        self.assertEqual(matching_grants('get:drinks'), frozenset([
+            'get:drinks', '*', 'get:*', '*:drinks', '*:*']))
+        self.assertEqual(matching_grants('drinks'),
+                         frozenset(['drinks', '*']))
+        grants = matching_grants('patch:drinks:recipe')
+        for grant in ('patch:*', '*:drinks:*', '*:*:recipe', '*:*:*',
+                      'patch:drinks:*'):
+            self.assertIn(grant, grants)
+        for grant in ('patch', 'patch:drinks', 'patch:*:*:*', 'recipe:*'):
+            self.assertNotIn(grant, grants)
+
+    def test_permission_set_checks(self):
+        granted = PermissionSet(['get:drinks', 'patch:*'])
+
+        self.assertTrue(granted.has_all(['get:drinks', 'patch:drinks']))
+        self.assertFalse(granted.has_all(['get:drinks', 'delete:drinks']))
+        self.assertTrue(granted.has_all([]))
+        self.assertTrue(granted.has_any(['delete:drinks', 'patch:menu']))
+        self.assertFalse(granted.has_any([]))
+        self.assertFalse(PermissionSet.from_payload({}).has('get:drinks'))
+        self.assertFalse(PermissionSet([]).has('*'))
+
+    def test_verified_tokens_are_cached(self):
+        token = make_token(['get:drinks'])
+        self.get('/drinks', token)
+        self.get('/drinks', token)
+        stats = self.auth.stats()
+
+        self.assertEqual(stats['tokens']['hits'], 1)
+        self.assertEqual(stats['tokens']['misses'], 1)
+        self.assertEqual(stats['timings']['decode']['count'], 1)
+        self.assertEqual(stats['timings']['total']['count'], 2)
+
+    def test_failed_steps_are_timed(self):
+        self.client().get('/drinks')
+        self.get('/drinks', make_token(['post:drinks']))
+        timings = self.auth.stats()['timings']
+
+        self.assertEqual(timings['header']['count'], 2)
+        self.assertEqual(timings['permissions']['count'], 1)
+        self.assertEqual(timings['total']['count'], 2)
+
+    def test_token_cache_expires_with_the_token(self):
+        cache = TokenCache()
+        cache.put('token', {'exp': time.time() - 1}, PermissionSet([]))
+
+        self.assertIsNone(cache.get('token'))
+
+    def test_token_cache_evicts_the_least_recently_used(self):
+        cache = TokenCache(max_entries=2)
+        for token in ('a', 'b'):
+            cache.put(token, {}, PermissionSet([]))
+        cache.get('a')
+        cache.put('c', {}, PermissionSet([]))
+
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('c'))
+        self.assertEqual(cache.stats()['size'], 2)
+
+    def test_token_cache_keeps_entries_at_most_max_ttl(self):
+        cache = TokenCache(max_ttl=0)
+        cache.put('token', {'exp': time.time() + 600}, PermissionSet([]))
+
+        self.assertIsNone(cache.get('token'))
+
+    def test_token_cache_does_not_hold_the_token(self):
+        cache = TokenCache()
+        token = make_token(['get:drinks'])
+        cache.put(token, {}, PermissionSet([]))
+
+        self.assertNotIn(token, cache._entries)
+        self.assertFalse(any(token.encode() in key
+                             for key in cache._entries))
+
+    def test_views_cannot_change_the_cached_payload(self):
+        @self.app.route('/mutate')
+        @self.auth.requires_auth('get:drinks')
+        def mutate(payload):
+            payload['sub'] = 'someone else'
+            payload['permissions'].append('delete:drinks')
+            return 'changed'
+
+        token = make_token(['get:drinks'])
+        self.get('/mutate', token)
+        self.get('/mutate', token)
+        res = self.get('/drinks', token)
+
+        self.assertEqual(res.data, b'user')
+        payload, granted = self.auth.authenticate(token)
+        self.assertEqual(payload['permissions'], ['get:drinks'])
+        self.assertFalse(granted.has('delete:drinks'))
+
+    def rsa_key_pair(self):
+        # (private PEM, public PEM) of a fresh RS256 key
+        try:
+            from cryptography.hazmat.primitives import serialization
+            from cryptography.hazmat.primitives.asymmetric import rsa
+        except ImportError:
+            self.skipTest('cryptography is not installed')
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        private_pem = key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption()).decode()
+        public_pem = key.public_key().public_bytes(
+            serialization.Encoding.PEM,
+            serialization.PublicFormat.SubjectPublicKeyInfo)
+        return private_pem, public_pem
+
+    def test_pem_key_provider(self):
+        private_pem, public_pem = self.rsa_key_pair()
+        with tempfile.NamedTemporaryFile(suffix='.pem', delete=False) as f:
+            f.write(public_pem)
+        self.addCleanup(os.remove, f.name)
+        self.auth.keys = PEMKeyProvider(f.name)
+
+        rs256 = make_token(['get:drinks'], key=private_pem, algorithm='RS256')
+        hs256 = make_token(['get:drinks'])
+        self.assertEqual(self.get('/drinks', rs256).status_code, 200)
+        self.assertEqual(self.get('/drinks', hs256).status_code, 401)
+
+
+    def test_jwks_key_provider(self):
+        from jose import jwk
+        private_pem, public_pem = self.rsa_key_pair()
+        key = dict(jwk.construct(public_pem, 'RS256').to_dict(), kid='k1')
+        with tempfile.NamedTemporaryFile(
+                'w', suffix='.json', delete=False) as f:
+            json.dump({'keys': [key]}, f)
+        self.addCleanup(os.remove, f.name)
+        keys = JWKSKeyProvider('file://' + f.name)
+        self.addCleanup(keys.close)
+        self.auth.keys = keys
+
+        token = make_token(['get:drinks'], key=private_pem,
+                           algorithm='RS256', kid='k1')
+        unknown = make_token(['get:drinks'], key=private_pem,
+                             algorithm='RS256', kid='k2')
+        self.assertEqual(self.get('/drinks', token).status_code, 200)
+        self.assertEqual(self.get('/drinks', unknown).status_code, 401)
+        self.assertEqual(self.get('/drinks', make_token(['get:drinks']))
+                         .status_code, 401)
+        self.assertEqual(keys.stats(), {'provider': 'jwks', 'keys': 1,
+                                        'fetches': 1})
+
+
+class StubJWKSKeyProvider(JWKSKeyProvider):
+    """A JWKS key provider whose endpoint is the published dict"""
+
+    def __init__(self, published, ttl=600, **options):
+        super().__init__('https://fsnd.test/.well-known/jwks.json', **options)
+        self.published = published
+        self.ttl = ttl
+        self.down = False
+        self.delay = 0
+
+    def fetch(self):
+        time.sleep(self.delay)
+        if self.down:
+            raise OSError('JWKS endpoint is down')
+        now = time.time()
+        self._keys = dict(self.published)
+        self._fetched_at, self._expires_at = now, now + self.ttl
+        self.fetches += 1
+
+
+class JWKSKeyProviderTestCase(unittest.TestCase):
+    """This class represents the JWKS key provider test case"""
+
+    def test_unknown_kids_refetch_at_most_once_per_interval(self):
+        keys = StubJWKSKeyProvider({'k1': 'key 1'})
+
+        self.assertEqual(keys.get_key('k1'), 'key 1')
+        for _ in range(5):
+            self.assertIsNone(keys.get_key('k2'))
+        self.assertEqual(keys.fetches, 1)
+
+        keys.published['k2'] = 'key 2'
+        keys._fetched_at -= keys.unknown_kid_interval
+        self.assertEqual(keys.get_key('k2'), 'key 2')
+        self.assertEqual(keys.fetches, 2)
+
+    def test_concurrent_misses_share_one_fetch(self):
+        keys = StubJWKSKeyProvider({'k1': 'key 1'})
+        keys.get_key('k1')
+        keys.published['k2'] = 'key 2'
+        keys._fetched_at -= keys.unknown_kid_interval
+        keys.delay = 0.2
+        found = []
+        threads = [threading.Thread(target=lambda: found.append(
+            keys.get_key('k2'))) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(found, ['key 2'] * 10)
+        self.assertEqual(keys.fetches, 2)
+
+    def test_stale_keys_are_served_up_to_max_stale(self):
+        keys = StubJWKSKeyProvider({'k1': 'key 1'}, ttl=60, max_stale=100)
+        keys.get_key('k1')
+        keys.down = True
+
+        keys._expires_at = time.time() - 50
+        self.assertEqual(keys.get_key('k1'), 'key 1')
+
+        keys._expires_at = time.time() - 101
+        for _ in range(2):
+            with self.assertRaises(AuthError) as raised:
+                keys.get_key('k1')
+            self.assertEqual(raised.exception.status_code, 503)
+
+    def test_503_when_no_keys_were_ever_fetched(self):
+        keys = StubJWKSKeyProvider({'k1': 'key 1'})
+        keys.down = True
+
+        with self.assertRaises(AuthError) as raised:
+            keys.get_key('k1')
+        self.assertEqual(raised.exception.status_code, 503)
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
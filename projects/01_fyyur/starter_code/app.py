@@ -3,6 +3,7 @@
 #----------------------------------------------------------------------------#
 # Starter Code
 import json
+import sys
 import dateutil.parser
 import babel
 from flask import Flask, render_template, request, Response, flash, redirect, url_for, jsonify, abort
@@ -13,9 +14,14 @@ from logging import Formatter, FileHandler
 from flask_wtf import Form
 from forms import *
 # Added
+import babel.dates
+from functools import lru_cache
 from flask_migrate import Migrate
 import config
 from sqlalchemy import func
+from search import create_search_indexes, search_names
+from importer import import_data_command
+from cache import page_cache, cached_page, add_page_tags, mark_changed
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
@@ -26,15 +32,55 @@ from models import *
 # Filters.
 #----------------------------------------------------------------------------#
 
-def format_datetime(value, format='medium'):
-  date = dateutil.parser.parse(value)
-  if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-  elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  return babel.dates.format_datetime(date, format)
+DATETIME_FORMATS = {
+  'full': "EEEE MMMM, d, y 'at' h:mma",
+  'medium': "EE MM, dd, y h:mma"
+}
+
+@lru_cache(maxsize=None)
+def datetime_pattern(format, locale):
+  # Parsed babel pattern and Locale per (format, locale); None for babel's own 'long'/'short' formats
+  pattern = DATETIME_FORMATS.get(format, format)
+  if pattern in ('long', 'short'):
+    return None, locale
+  return babel.dates.parse_pattern(pattern), babel.Locale.parse(locale or babel.dates.LC_TIME)
+
+@lru_cache(maxsize=4096)
+def _format_datetime(value, format, locale):
+  # Listings repeat the same start times, so formatted strings are memoized per (value, format, locale)
+  pattern, locale = datetime_pattern(format, locale)
+  if pattern is None:
+    return babel.dates.format_datetime(value, format, locale=locale)
+  return pattern.apply(value, locale)
+
+def format_datetime(value, format='medium', locale=None):
+  # Accepts datetimes as loaded from the database; strings are still parsed for older callers
+  if isinstance(value, str):
+    value = dateutil.parser.parse(value)
+  return _format_datetime(value, format, locale)
 
 app.jinja_env.filters['datetime'] = format_datetime
+app.jinja_env.filters['genre_name'] = genre_cache.name
+app.jinja_env.globals['genre_cache'] = genre_cache
+
+app.cli.add_command(import_data_command)
+page_cache.configure(app.config)
+
+@app.cli.command('create-search-indexes')
+def create_search_indexes_command():
+  """Create the venue and artist name search indexes (FTS5 tables on SQLite)."""
+  create_search_indexes()
+
+@app.cli.command('refresh-show-counts')
+def refresh_show_counts_command():
+  """Recompute upcoming show counters; run daily just after midnight."""
+  refresh_upcoming_show_counts()
+  # The counters are shown on /venues only (a bulk UPDATE fires no per-row tags)
+  page_cache.invalidate('venues')
+
+@app.before_first_request
+def load_genre_cache():
+  genre_cache.load()
 
 #----------------------------------------------------------------------------#
 # Controllers.
@@ -48,18 +94,12 @@ def index():
 #  ----------------------------------------------------------------
 
 @app.route('/venues')
+@cached_page('venues')
 def venues():
   # DONE: replace with real venues data.
   # DONE: num_shows should be aggregated based on number of upcoming shows per venue.
-  areas = [] # areas is an array to house each state/city combination and show the venues located in that city as well as the # of upcoming shows that they have
-  venues = Venue.query.all() # retrieve all venues
-  # Loop through each venue distinct city/state combo
-  for v in db.session.query(Venue.city, Venue.state).distinct():
-    venue_array = []
-    for v_sub in db.session.query(Venue).filter_by(city = v.city).filter_by(state = v.state):
-      venue_array.append({'id' : v_sub.id, 'name' : v_sub.name, 'num_upcoming_shows' : v_sub.upcoming_show_count()})
-    obj = {'city' : v.city, 'state' : v.state, 'venues' : venue_array}
-    areas.append(obj)
+  # areas is an array to house each state/city combination and show the venues located in that city as well as the # of upcoming shows that they have
+  areas = Venue.areas()
   return render_template('pages/venues.html', areas=areas)
 
 @app.route('/venues/search', methods=['POST'])
@@ -69,7 +109,7 @@ def search_venues():
   # TESTED: search for "Music" should return "The Musical Hop" and "Park Square Live Music & Coffee"
 
   search_term = request.form.get('search_term', '')
-  relevant_venues = db.session.query(Venue).filter(Venue.name.ilike('%' + search_term + '%')).all()
+  relevant_venues = search_names(Venue, search_term)
   response={
     'count': len(relevant_venues),   
     "data": relevant_venues
@@ -77,22 +117,21 @@ def search_venues():
   return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''))
 
 @app.route('/venues/<int:venue_id>')
+@cached_page('venue:{venue_id}', 'genres')
 def show_venue(venue_id):
   # shows the venue page with the given venue_id
   # DONE: replace with real venue data from the venues table, using venue_id
 
-  venue = Venue.query.get(venue_id)
+  venue = Venue.get_with_shows(venue_id)
   # If no venue is returned by above, return a 404 error
   if (not bool(venue)):
     return render_template('errors/404.html')
-  venue.past_shows = venue.past_shows()
-  venue.upcoming_shows = venue.upcoming_shows()
+  venue.past_shows, venue.upcoming_shows = venue.split_shows()
   venue.past_shows_count = len(venue.past_shows)
   venue.upcoming_shows_count = len(venue.upcoming_shows)
-
-  venue.display_genres = []
-  for g in venue.genres:
-    venue.display_genres.append(Genre.query.get(g.genre_id).name)
+  venue.display_genres = venue.genre_names()
+  # Artist names and images on this page come from the artist rows
+  add_page_tags(*['artist:%d' % show.artist_id for show in venue.shows])
 
   return render_template('pages/show_venue.html', venue=venue)
 
@@ -117,21 +156,17 @@ def create_venue_submission():
   phone = request.form.get('phone', '')
   facebook_link = request.form.get('facebook_link', '')
   genres = request.form.getlist('display_genres') # This will be list of string values
-  genre_ints = []
-  for g in genres:
-    genre_obj = db.session.query(Genre).filter_by(name = g).first()
-    genre_ints.append(genre_obj.id)
+  genre_ints = genre_cache.ids(genres)
   try:
     # Create a new Venue object based on posted values
     new_venue = Venue(name=name, city=city, state=state, address=address, phone=phone, facebook_link=facebook_link)
     db.session.add(new_venue)
+    # The flush INSERTs the venue and hands back its primary key (RETURNING on PostgreSQL), so the genre links join the same transaction
+    db.session.flush()
+    db.session.add_all([GenreVenue(venue_id = new_venue.id, genre_id = gi) for gi in genre_ints])
+    body['id'] = new_venue.id
     db.session.commit()
-    venue_obj = Venue.query.filter_by(name = new_venue.name).first()
-    for gi in genre_ints:
-      new_GenreVenue = GenreVenue(venue_id = venue_obj.id, genre_id = gi)
-      db.session.add(new_GenreVenue)
-    db.session.commit()
-    body['name'] = new_venue.name
+    body['name'] = name
     body['error'] = ''
   except:
     db.session.rollback()
@@ -145,7 +180,7 @@ def create_venue_submission():
     # DONE: modify data to be the data object returned from db insertion
     # return jsonify(body)
     # on successful db insert, flash success
-    flash('Venue ' + new_venue.name + ' was successfully listed!')
+    flash('Venue ' + body['name'] + ' was successfully listed!')
   else:
     # DONE: on unsuccessful db insert, flash an error instead.
     flash('An error occurred. Venue ' + body['name'] + ' could not be listed. Please try again. If this issue persists, call support.')
@@ -157,12 +192,15 @@ def create_venue_submission():
 def delete_venue(venue_id):
   # WIP: Complete this endpoint for taking a venue_id, and using
   # SQLAlchemy ORM to delete a record. Handle cases where the session commit could fail.
-  venue_to_be_deleted = Venue.query.get(venue_id)
-  response = {'venue' : venue_to_be_deleted}
+  # Read the name up front: the instance is expired by the commit and detached by the close below
+  venue_name = Venue.query.get(venue_id).name
+  response = {'venue' : venue_name}
   error = False
   try:
     GenreVenue.query.filter_by(venue_id = venue_id).delete()
     Venue.query.filter_by(id=venue_id).delete()
+    # Bulk deletes skip the session, so name the cached pages they affect
+    mark_changed('venues', 'shows', 'venue:%s' % venue_id)
     db.session.commit()
   except:
     db.session.rollback()
@@ -170,9 +208,9 @@ def delete_venue(venue_id):
   finally:
     db.session.close()
   if error:
-    response['message'] = 'Failed to delete ' + venue_to_be_deleted.name + '.'
+    response['message'] = 'Failed to delete ' + venue_name + '.'
   else:
-    response['message'] = venue_to_be_deleted.name + ' successfully deleted.'
+    response['message'] = venue_name + ' successfully deleted.'
 
   # DONE BONUS CHALLENGE: Implement a button to delete a Venue on a Venue Page, have it so that
   # clicking that button delete it from the db then redirect the user to the homepage
@@ -181,6 +219,7 @@ def delete_venue(venue_id):
 #  Artists
 #  ----------------------------------------------------------------
 @app.route('/artists')
+@cached_page('artists')
 def artists():
   artists = db.session.query(Artist.id, Artist.name).distinct()
   # DONE: replace with real data returned from querying the database
@@ -194,7 +233,7 @@ def search_artists():
   # TESTED: seach for "A" should return "Guns N Petals", "Matt Quevado", and "The Wild Sax Band".
   # TESTED: search for "band" should return "The Wild Sax Band".
   search_term = request.form.get('search_term', '')
-  relevant_artists = db.session.query(Artist).filter(Artist.name.ilike('%' + search_term + '%')).all()
+  relevant_artists = search_names(Artist, search_term)
   response={
     'count': len(relevant_artists),   
     "data": relevant_artists
@@ -203,20 +242,18 @@ def search_artists():
 
 
 @app.route('/artists/<int:artist_id>')
+@cached_page('artist:{artist_id}', 'genres')
 def show_artist(artist_id):
   # shows the venue page with the given venue_id
   # DONE: replace with real venue data from the venues table, using venue_id
-  artist = Artist.query.get(artist_id)
+  artist = Artist.get_with_shows(artist_id)
   if (not bool(artist)):
     return render_template('errors/404.html')
-  artist.past_shows = artist.past_shows()
-  artist.upcoming_shows = artist.upcoming_shows()
+  artist.past_shows, artist.upcoming_shows = artist.split_shows()
   artist.past_shows_count = len(artist.past_shows)
   artist.upcoming_shows_count = len(artist.upcoming_shows)
-
-  artist.display_genres = []
-  for g in artist.genres:
-    artist.display_genres.append(Genre.query.get(g.genre_id).name)
+  artist.display_genres = artist.genre_names()
+  add_page_tags(*['venue:%d' % show.venue_id for show in artist.shows])
 
   return render_template('pages/show_artist.html', artist=artist)
 
@@ -231,6 +268,7 @@ def delete_artist(artist_id):
   try:
     ArtistGenre.query.filter_by(artist_id = artist_id).delete()
     Artist.query.filter_by(id = artist_id).delete()
+    mark_changed('artists', 'shows', 'artist:%s' % artist_id)
     db.session.commit()
   except:
     db.session.rollback()
@@ -249,12 +287,10 @@ def delete_artist(artist_id):
 @app.route('/artists/<int:artist_id>/edit', methods=['GET'])
 def edit_artist(artist_id):
   artist = Artist.query.get(artist_id)
-  artist.display_genres = []
-  for g in artist.genres:
-    artist.display_genres.append(Genre.query.get(g.genre_id).name)
-  form = ArtistForm(obj=artist)
   if (not bool(artist)):
     return render_template('errors/404.html')
+  artist.display_genres = artist.genre_names()
+  form = ArtistForm(obj=artist)
   # DONE?: populate form with fields from artist with ID <artist_id>
   # return ' - '.join(artist.display_genres)
   return render_template('forms/edit_artist.html', form=form, artist=artist)
@@ -274,27 +310,10 @@ def edit_artist_submission(artist_id):
     artist.phone = phone
     artist.facebook_link = facebook_link
 
-    # Delete all artist_genre rows that were not selected. Then loop through genres and add artist_genre rows where applicable.
+    # Bring the ArtistGenre rows in line with the selected genres, in the same transaction as the update above
     genres = request.form.getlist('display_genres') # This will be list of string values
-    # return ' ~ '.join(request.form.getlist('display_genres')) 
-    
-    previous_genres = ArtistGenre.query.filter_by(artist_id = artist_id).all() # Will be list of ArtistGenre objects
-    previous_genre_ints = [] # List of ints
-    genre_ints = [] # List of ints
-    for pg in previous_genres:
-      previous_genre_ints.append(pg.genre_id)
-    # return str(previous_genre_ints[0])
-    for g in genres:
-      genre_obj = db.session.query(Genre).filter_by(name = g).first()
-      genre_ints.append(genre_obj.id)
-    # return str(len(genre_ints))
-    for pgi in previous_genre_ints:
-      if (pgi not in genre_ints):
-        ArtistGenre.query.filter_by(artist_id = artist_id).filter_by(genre_id = pgi).delete()
-    for gi in genre_ints:
-      if (gi not in previous_genre_ints):
-        new_ArtistGenre = ArtistGenre(artist_id = artist_id, genre_id = gi)
-        db.session.add(new_ArtistGenre)
+    sync_genres(ArtistGenre, 'artist_id', artist_id, genre_cache.ids(genres))
+    mark_changed('artist:%s' % artist_id) # the genre links are rewritten with bulk SQL
     db.session.commit()
   except:
     db.session.rollback()
@@ -309,12 +328,10 @@ def edit_artist_submission(artist_id):
 @app.route('/venues/<int:venue_id>/edit', methods=['GET'])
 def edit_venue(venue_id):
   venue = Venue.query.get(venue_id)
-  venue.display_genres = []
-  for g in venue.genres:
-    venue.display_genres.append(Genre.query.get(g.genre_id).name)
-  form = VenueForm(obj=venue)
   if (not bool(venue)):
     return render_template('errors/404.html')
+  venue.display_genres = venue.genre_names()
+  form = VenueForm(obj=venue)
   # DONE?: populate form with fields from venue with ID <venue_id>
   # return ' - '.join(venue.display_genres)
   return render_template('forms/edit_venue.html', form=form, venue=venue)
@@ -336,27 +353,10 @@ def edit_venue_submission(venue_id):
     venue.phone = phone
     venue.facebook_link = facebook_link
 
-    # Delete all venue_genre rows that were not selected. Then loop through genres and add venue_genre rows where applicable.
+    # Bring the GenreVenue rows in line with the selected genres, in the same transaction as the update above
     genres = request.form.getlist('display_genres') # This will be list of string values
-    # return ' ~ '.join(request.form.getlist('display_genres')) 
-    
-    previous_genres = GenreVenue.query.filter_by(venue_id = venue_id).all() # Will be list of GenreVenue objects
-    previous_genre_ints = [] # List of ints
-    genre_ints = [] # List of ints
-    for pg in previous_genres:
-      previous_genre_ints.append(pg.genre_id)
-    # return str(previous_genre_ints[0])
-    for g in genres:
-      genre_obj = db.session.query(Genre).filter_by(name = g).first()
-      genre_ints.append(genre_obj.id)
-    # return str(len(genre_ints))
-    for pgi in previous_genre_ints:
-      if (pgi not in genre_ints):
-        GenreVenue.query.filter_by(venue_id = venue_id).filter_by(genre_id = pgi).delete()
-    for gi in genre_ints:
-      if (gi not in previous_genre_ints):
-        new_GenreVenue = GenreVenue(venue_id = venue_id, genre_id = gi)
-        db.session.add(new_GenreVenue)
+    sync_genres(GenreVenue, 'venue_id', venue_id, genre_cache.ids(genres))
+    mark_changed('venue:%s' % venue_id) # the genre links are rewritten with bulk SQL
     db.session.commit()
   except:
     db.session.rollback()
@@ -387,22 +387,18 @@ def create_artist_submission():
   phone = request.form.get('phone', '')
   facebook_link = request.form.get('facebook_link', '')
   genres = request.form.getlist('display_genres') # This will be list of string values
-  genre_ints = []
-  for g in genres:
-    genre_obj = db.session.query(Genre).filter_by(name = g).first()
-    genre_ints.append(genre_obj.id)
+  genre_ints = genre_cache.ids(genres)
   # return str(len(genre_ints))
   try:
     # Create a new Artist object based on posted values
     new_artist = Artist(name=name, city=city, state=state, phone=phone, facebook_link=facebook_link)
     db.session.add(new_artist)
+    # The flush INSERTs the artist and hands back its primary key (RETURNING on PostgreSQL), so the genre links join the same transaction
+    db.session.flush()
+    db.session.add_all([ArtistGenre(artist_id = new_artist.id, genre_id = gi) for gi in genre_ints])
+    body['id'] = new_artist.id
     db.session.commit()
-    artist_obj = Artist.query.filter_by(name = new_artist.name).first()
-    for gi in genre_ints:
-      new_ArtistGenre = ArtistGenre(artist_id = artist_obj.id, genre_id = gi)
-      db.session.add(new_ArtistGenre)
-    db.session.commit()
-    body['name'] = new_artist.name
+    body['name'] = name
     body['error'] = ''
   except:
     db.session.rollback()
@@ -412,7 +408,7 @@ def create_artist_submission():
   finally:
     db.session.close()
   if not error:
-    flash('Artist ' + new_artist.name + ' was successfully listed!')
+    flash('Artist ' + body['name'] + ' was successfully listed!')
   else:
     flash('An error occurred. Artist ' + body['name'] + ' could not be listed. Please try again. If this issue persists, call support.')
 
@@ -422,21 +418,30 @@ def create_artist_submission():
 #  Shows
 #  ----------------------------------------------------------------
 
+def show_filters(args):
+  # Reads the optional search term, date range and page cursor shared by /shows and /shows/search
+  try:
+    filters = {
+      'search_term' : args.get('search_term', ''),
+      'start' : dateutil.parser.parse(args['from']) if args.get('from') else None,
+      'end' : dateutil.parser.parse(args['to']) if args.get('to') else None,
+      'after' : Show.decode_key(args['after']) if args.get('after') else None
+    }
+  except (ValueError, OverflowError):
+    abort(400)
+  return filters
+
 @app.route('/shows')
+@cached_page('shows')
 def shows():
-  # displays list of shows at /shows
-
-  shows = Show.query.all()
-  for s in shows:
-    s.start_time = str(s.start_time)
-    artist = Artist.query.filter_by(id=s.artist_id).first()
-    s.artist_name = artist.name
-    s.artist_image_link = artist.image_link
-    venue = Venue.query.filter_by(id=s.venue_id).first()
-    s.venue_name = venue.name
+  # displays list of shows at /shows, one page at a time, optionally limited to ?from=&to= dates
+  shows, next_key = Show.listing(**show_filters(request.args))
+  next_page = None
+  if next_key:
+    next_page = url_for('shows', after=Show.encode_key(next_key), **{k: v for k, v in request.args.items() if k != 'after'})
 
   # DONE: replace with real shows data.
-  return render_template('pages/shows.html', shows=shows)
+  return render_template('pages/shows.html', shows=shows, next_page=next_page)
 
 @app.route('/shows/create')
 def create_shows():
@@ -477,29 +482,25 @@ def create_show_submission():
 # NEW FUNCTIONALITY
 @app.route('/shows/search', methods=['POST'])
 def search_shows():
-  search_term = request.form.get('search_term', '')
-  relevant_shows = []
-  all_shows = Show.query.all()
-  for s in all_shows:
-    s.start_time = str(s.start_time)
-    artist = Artist.query.filter_by(id=s.artist_id).first()
-    s.artist_name = artist.name
-    s.artist_image_link = artist.image_link
-    venue = Venue.query.filter_by(id=s.venue_id).first()
-    s.venue_name = venue.name
-    if (search_term.lower() in artist.name.lower()):
-      relevant_shows.append(s)
-      continue
-    if (search_term.lower() in venue.name.lower()):
-      relevant_shows.append(s)
-      continue
-      
-  # relevant_shows = db.session.query(Venue).filter(Venue.name.ilike('%' + search_term + '%')).all()
+  # Matching on artist and venue names happens in SQL. The total is counted on the first page and carried along by the "more results" form.
+  filters = show_filters(request.form)
+  relevant_shows, next_key = Show.listing(**filters)
+  count = request.form.get('count', type=int)
+  if count is None:
+    count = len(relevant_shows)
+    if next_key:
+      count = Show.count_matching(filters['search_term'], filters['start'], filters['end'])
   response={
-    'count': len(relevant_shows),   
-    "data": relevant_shows
+    'count': count,
+    "data": relevant_shows,
+    'next_cursor': Show.encode_key(next_key) if next_key else None
   }
-  return render_template('pages/search_shows.html', results=response, search_term=request.form.get('search_term', ''))
+  return render_template('pages/search_shows.html', results=response, search_term=request.form.get('search_term', ''),
+    date_from=request.form.get('from', ''), date_to=request.form.get('to', ''))
+
+@app.route('/cache/stats')
+def cache_stats():
+  return jsonify(page_cache.stats())
 
 @app.errorhandler(404)
 def not_found_error(error):
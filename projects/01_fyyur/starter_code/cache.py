@@ -0,0 +1,327 @@
+#----------------------------------------------------------------------------#
+# Page and fragment cache with entity-tag invalidation.
+#
+# Rendered output is stored under a key (the request path for pages) along
+# with the entity tags it depends on, e.g. 'venue:3', 'artist:7', 'venues'.
+# Committing a change to a Venue, Artist, Show or genre link evicts every
+# entry carrying one of the affected tags, and only those entries.
+#
+# Backends are picked with PAGE_CACHE_TYPE in config.py:
+#   'lru'        in-process LRU with TTL (default)
+#   'filesystem' pickled entries under PAGE_CACHE_DIR, shared by processes on one host
+#   'redis'      any Redis-compatible server at PAGE_CACHE_REDIS_URL (needs the redis package)
+#   'null'       caching disabled
+#----------------------------------------------------------------------------#
+
+import os
+import time
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import wraps
+from flask import request, session, g
+from sqlalchemy import event
+
+from models import db, Venue, Artist, Show, Genre, ArtistGenre, GenreVenue
+
+#  Backends
+#  ----------------------------------------------------------------
+#  get(key) -> value or None, set(key, value, ttl), delete_many(keys),
+#  add_to_tags(key, tags, ttl), pop_tag(tag) -> keys that carried the tag
+
+class NullBackend(object):
+  def get(self, key):
+    return None
+  def set(self, key, value, ttl):
+    pass
+  def delete_many(self, keys):
+    pass
+  def add_to_tags(self, key, tags, ttl):
+    pass
+  def pop_tag(self, tag):
+    return []
+  def clear(self):
+    pass
+
+class LRUBackend(object):
+  def __init__(self, max_entries=1000):
+    self.max_entries = max_entries
+    self._entries = OrderedDict() # key -> (expires_at, value), least recently used first
+    self._tags = {} # tag -> set of keys
+    self._lock = threading.Lock()
+
+  def get(self, key):
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is None:
+        return None
+      if entry[0] < time.time():
+        del self._entries[key]
+        return None
+      self._entries.move_to_end(key)
+      return entry[1]
+
+  def set(self, key, value, ttl):
+    with self._lock:
+      self._entries[key] = (time.time() + ttl, value)
+      self._entries.move_to_end(key)
+      while len(self._entries) > self.max_entries:
+        self._entries.popitem(last=False)
+
+  def delete_many(self, keys):
+    with self._lock:
+      for key in keys:
+        self._entries.pop(key, None)
+
+  def add_to_tags(self, key, tags, ttl):
+    with self._lock:
+      for tag in tags:
+        keys = self._tags.setdefault(tag, set())
+        # Drop evicted or expired keys so tag sets stay bounded by the cache size
+        if len(keys) > self.max_entries:
+          keys.intersection_update(self._entries)
+        keys.add(key)
+
+  def pop_tag(self, tag):
+    with self._lock:
+      return list(self._tags.pop(tag, ()))
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+      self._tags.clear()
+
+class FileSystemBackend(object):
+  def __init__(self, directory):
+    self.directory = directory
+    os.makedirs(os.path.join(directory, 'tags'), exist_ok=True)
+
+  def _path(self, name, folder=''):
+    return os.path.join(self.directory, folder, hashlib.sha1(name.encode('utf-8')).hexdigest())
+
+  def get(self, key):
+    try:
+      with open(self._path(key), 'rb') as f:
+        expires_at, value = pickle.load(f)
+    except (IOError, OSError, EOFError, pickle.UnpicklingError):
+      return None
+    if expires_at < time.time():
+      self.delete_many([key])
+      return None
+    return value
+
+  def set(self, key, value, ttl):
+    # Write then rename so readers never see a partial file
+    path = self._path(key)
+    tmp = '%s.%d.%d' % (path, os.getpid(), threading.get_ident())
+    with open(tmp, 'wb') as f:
+      pickle.dump((time.time() + ttl, value), f, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+
+  def delete_many(self, keys):
+    for key in keys:
+      try:
+        os.remove(self._path(key))
+      except OSError:
+        pass
+
+  def add_to_tags(self, key, tags, ttl):
+    for tag in tags:
+      with open(self._path(tag, 'tags'), 'a', encoding='utf-8') as f:
+        f.write(key + '\n')
+
+  def pop_tag(self, tag):
+    path = self._path(tag, 'tags')
+    claimed = '%s.%d.%d' % (path, os.getpid(), threading.get_ident())
+    try:
+      os.replace(path, claimed)
+    except OSError:
+      return []
+    with open(claimed, encoding='utf-8') as f:
+      keys = set(line.rstrip('\n') for line in f if line.strip())
+    os.remove(claimed)
+    return list(keys)
+
+  def clear(self):
+    for folder in ('', 'tags'):
+      directory = os.path.join(self.directory, folder)
+      for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+          os.remove(path)
+
+class RedisBackend(object):
+  def __init__(self, url, prefix='fyyur:'):
+    import redis # optional dependency, only needed for this backend
+    self.client = redis.Redis.from_url(url)
+    self.prefix = prefix
+
+  def get(self, key):
+    value = self.client.get(self.prefix + key)
+    return None if value is None else value.decode('utf-8')
+
+  def set(self, key, value, ttl):
+    self.client.set(self.prefix + key, value.encode('utf-8'), ex=int(ttl))
+
+  def delete_many(self, keys):
+    if keys:
+      self.client.delete(*[self.prefix + k for k in keys])
+
+  def add_to_tags(self, key, tags, ttl):
+    pipe = self.client.pipeline()
+    for tag in tags:
+      pipe.sadd(self.prefix + 'tag:' + tag, key)
+      pipe.expire(self.prefix + 'tag:' + tag, int(ttl))
+    pipe.execute()
+
+  def pop_tag(self, tag):
+    pipe = self.client.pipeline()
+    pipe.smembers(self.prefix + 'tag:' + tag)
+    pipe.delete(self.prefix + 'tag:' + tag)
+    members, _ = pipe.execute()
+    return [m.decode('utf-8') for m in members]
+
+  def clear(self):
+    keys = list(self.client.scan_iter(self.prefix + '*'))
+    if keys:
+      self.client.delete(*keys)
+
+def create_backend(config):
+  cache_type = config.get('PAGE_CACHE_TYPE', 'lru')
+  if cache_type == 'lru':
+    return LRUBackend(config.get('PAGE_CACHE_SIZE', 1000))
+  if cache_type == 'filesystem':
+    return FileSystemBackend(config['PAGE_CACHE_DIR'])
+  if cache_type == 'redis':
+    return RedisBackend(config['PAGE_CACHE_REDIS_URL'])
+  if cache_type == 'null':
+    return NullBackend()
+  raise ValueError('Unknown PAGE_CACHE_TYPE %r' % cache_type)
+
+#  Cache
+#  ----------------------------------------------------------------
+
+class PageCache(object):
+  def __init__(self):
+    self.backend = NullBackend()
+    self.default_ttl = 300
+    self.reset_stats()
+
+  def configure(self, config):
+    self.backend = create_backend(config)
+    self.default_ttl = config.get('PAGE_CACHE_TTL', 300)
+
+  def reset_stats(self):
+    self.hits = self.misses = self.sets = self.evictions = 0
+
+  def stats(self):
+    lookups = self.hits + self.misses
+    return {
+      'backend': type(self.backend).__name__,
+      'hits': self.hits,
+      'misses': self.misses,
+      'hit_ratio': float(self.hits) / lookups if lookups else 0.0,
+      'sets': self.sets,
+      'evictions': self.evictions
+    }
+
+  def get(self, key):
+    value = self.backend.get(key)
+    if value is None:
+      self.misses += 1
+    else:
+      self.hits += 1
+    return value
+
+  def set(self, key, value, tags=(), ttl=None):
+    ttl = ttl or self.default_ttl
+    # Register the tags first: an invalidation racing with this set then evicts the new entry too
+    self.backend.add_to_tags(key, set(tags), ttl)
+    self.backend.set(key, value, ttl)
+    self.sets += 1
+
+  def cached(self, key, tags, render, ttl=None):
+    # Fragment helper: returns the cached value for key, or stores render()
+    value = self.get(key)
+    if value is None:
+      value = render()
+      self.set(key, value, tags, ttl)
+    return value
+
+  def invalidate(self, *tags):
+    for tag in set(tags):
+      keys = self.backend.pop_tag(tag)
+      self.backend.delete_many(keys)
+      self.evictions += len(keys)
+
+  def clear(self):
+    self.backend.clear()
+
+page_cache = PageCache()
+
+def add_page_tags(*tags):
+  # Lets a view tag the page being rendered with entities it only discovers while loading data
+  g.setdefault('page_cache_tags', set()).update(tags)
+
+def cached_page(*tags):
+  # Caches the rendered HTML of a GET view under its full path.
+  # tags may contain '{name}' placeholders filled from the view arguments, e.g. 'venue:{venue_id}'.
+  def decorator(f):
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+      # Pages carrying a flashed message belong to one visitor only
+      if request.method != 'GET' or session.get('_flashes'):
+        return f(*args, **kwargs)
+      key = 'page:' + request.full_path
+      body = page_cache.get(key)
+      if body is not None:
+        return body
+      g.page_cache_tags = set(t.format(**kwargs) for t in tags)
+      response = f(*args, **kwargs)
+      if isinstance(response, str) and not session.get('_flashes'):
+        page_cache.set(key, response, g.page_cache_tags)
+      return response
+    return wrapper
+  return decorator
+
+#  Invalidation
+#  ----------------------------------------------------------------
+
+def entity_tags(obj):
+  # Pages affected by a change to obj
+  if isinstance(obj, Venue):
+    return ['venues', 'shows', 'venue:%s' % obj.id]
+  if isinstance(obj, Artist):
+    return ['artists', 'shows', 'artist:%s' % obj.id]
+  if isinstance(obj, Show):
+    return ['venues', 'shows', 'venue:%s' % obj.venue_id, 'artist:%s' % obj.artist_id]
+  if isinstance(obj, GenreVenue):
+    return ['venue:%s' % obj.venue_id]
+  if isinstance(obj, ArtistGenre):
+    return ['artist:%s' % obj.artist_id]
+  if isinstance(obj, Genre):
+    return ['genres']
+  return []
+
+def mark_changed(*tags):
+  # For changes made with bulk SQL, which the flush hook below cannot see; applied on commit
+  db.session.info.setdefault('page_cache_tags', set()).update(tags)
+
+def _collect_tags(session, flush_context):
+  # after_flush still lists the flushed objects, now with their primary keys assigned
+  tags = session.info.setdefault('page_cache_tags', set())
+  for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+    tags.update(entity_tags(obj))
+
+def _invalidate_after_commit(session):
+  tags = session.info.pop('page_cache_tags', None)
+  if tags:
+    page_cache.invalidate(*tags)
+
+def _discard_after_rollback(session, previous_transaction):
+  session.info.pop('page_cache_tags', None)
+
+event.listen(db.session, 'after_flush', _collect_tags)
+event.listen(db.session, 'after_commit', _invalidate_after_commit)
+event.listen(db.session, 'after_soft_rollback', _discard_after_rollback)
@@ -0,0 +1,204 @@
+#----------------------------------------------------------------------------#
+# Bulk import of venues, artists and shows from CSV or NDJSON files.
+#
+#   flask import-data venues venues.csv
+#   flask import-data shows shows.ndjson --chunk-size 20000
+#
+# Files are streamed and inserted chunk by chunk (one executemany per chunk,
+# one commit per chunk), so memory use does not grow with the file size.
+# Venue and artist rows may carry a `genres` field: a list in NDJSON, or
+# names separated by ";" in CSV. Genre names resolve through genre_cache.
+# Rows that carry an `id` keep it, so a shows file can reference them; rows
+# with no id, or a blank one, get a new id above both the table's and the
+# file's largest id (found by one extra streaming pass over the file).
+# Fields may differ from row to row: a field a row leaves out gets its default.
+# The page cache is cleared at the end. With the default in-process 'lru'
+# backend that only reaches this process, so restart running servers (or wait
+# out PAGE_CACHE_TTL) to see the imported rows on cached pages.
+#----------------------------------------------------------------------------#
+
+import csv
+import json
+import time
+import click
+from flask.cli import with_appcontext
+import dateutil.parser
+from datetime import datetime
+from itertools import islice
+from sqlalchemy import Boolean, DateTime, Integer, func, text
+
+from cache import page_cache
+from models import db, Venue, Artist, Show, ArtistGenre, GenreVenue, genre_cache, refresh_upcoming_show_counts
+
+DEFAULT_CHUNK_SIZE = 5000
+
+# kind: (model, genre association model, association owner key)
+IMPORTABLE = {
+  'venues': (Venue, GenreVenue, 'venue_id'),
+  'artists': (Artist, ArtistGenre, 'artist_id'),
+  'shows': (Show, None, None),
+}
+
+TRUE_STRINGS = ('1', 't', 'true', 'y', 'yes')
+
+def read_rows(path, fmt=None):
+  # Yields one dict per record without reading the whole file
+  fmt = fmt or ('ndjson' if path.endswith(('.ndjson', '.jsonl', '.json')) else 'csv')
+  with open(path, newline='', encoding='utf-8') as f:
+    if fmt == 'csv':
+      for row in csv.DictReader(f):
+        yield row
+    else:
+      for line in f:
+        if line.strip():
+          yield json.loads(line)
+
+def chunked(rows, size):
+  rows = iter(rows)
+  while True:
+    chunk = list(islice(rows, size))
+    if not chunk:
+      return
+    yield chunk
+
+def parse_datetime(value):
+  # ISO 8601 is the common case and far cheaper than the general dateutil parser
+  try:
+    return datetime.fromisoformat(value)
+  except ValueError:
+    return dateutil.parser.parse(value)
+
+def clean_row(table, row):
+  # Returns (column values, genre names) with CSV strings converted to the column types
+  values = {}
+  for column in table.columns:
+    if column.name not in row:
+      continue
+    value = row[column.name]
+    if isinstance(value, str):
+      value = value.strip()
+      if value == '':
+        value = None
+      elif isinstance(column.type, Boolean):
+        value = value.lower() in TRUE_STRINGS
+      elif isinstance(column.type, Integer):
+        value = int(value)
+      elif isinstance(column.type, DateTime):
+        value = parse_datetime(value)
+    values[column.name] = value
+  genres = row.get('genres') or []
+  if isinstance(genres, str):
+    genres = [g.strip() for g in genres.split(';') if g.strip()]
+  return values, genres
+
+def normalize(table, rows):
+  # executemany binds every row against the first row's keys, so give the whole chunk one column set;
+  # a column a row leaves out gets its default, as it would in a single-row INSERT
+  names = set()
+  for values in rows:
+    names.update(values)
+  defaults = {}
+  for name in names:
+    default = table.columns[name].default
+    defaults[name] = default.arg if default is not None and default.is_scalar else None
+  return [dict(defaults, **values) for values in rows]
+
+def max_explicit_id(path, fmt=None):
+  # Largest id the file sets itself; new ids must stay above it, even those given to rows before it
+  top = 0
+  for row in read_rows(path, fmt):
+    value = row.get('id')
+    if isinstance(value, str):
+      value = value.strip()
+    if value not in (None, ''):
+      top = max(top, int(value))
+  return top
+
+def reserve_ids(table, floor):
+  # Moves the PostgreSQL sequence past floor (never back), so nextval cannot hand out an id the file uses
+  if db.engine.dialect.name == 'postgresql' and floor:
+    db.session.execute(text("SELECT setval(pg_get_serial_sequence(:table, 'id'), GREATEST(:floor, MAX(id), "
+      "COALESCE(pg_sequence_last_value(pg_get_serial_sequence(:table, 'id')::regclass), 0))) FROM {0}".format(table.name)),
+      {'table': table.name, 'floor': floor})
+    db.session.commit()
+
+def allocate_ids(table, count, floor=0):
+  # Ids taken before the INSERT let the genre links be built without relying on RETURNING order
+  if db.engine.dialect.name == 'postgresql':
+    result = db.session.execute(text("SELECT nextval(pg_get_serial_sequence(:table, 'id')) FROM generate_series(1, :count)"),
+      {'table': table.name, 'count': count})
+    return [row[0] for row in result]
+  # Other dialects are the single-writer local setup; a concurrent writer makes the INSERT fail rather than mislink
+  start = max(db.session.query(func.max(table.c.id)).scalar() or 0, floor)
+  return list(range(start + 1, start + count + 1))
+
+def insert_chunk(model, association, owner_key, chunk, floor=0):
+  table = model.__table__
+  cleaned = [clean_row(table, row) for row in chunk]
+  rows = [values for values, _ in cleaned]
+  for values in rows:
+    # A blank id cell means "assign one", not an explicit NULL
+    if 'id' in values and values['id'] is None:
+      del values['id']
+  if association is not None:
+    missing = [values for values in rows if 'id' not in values]
+    if missing:
+      for values, new_id in zip(missing, allocate_ids(table, len(missing), floor)):
+        values['id'] = new_id
+  db.session.execute(table.insert(), normalize(table, rows))
+  if association is None:
+    return 0
+  # Genres for the whole chunk are resolved against the cache and linked with one executemany
+  by_name = dict((name, genre_id) for genre_id, name in genre_cache.all())
+  links, unknown = [], 0
+  for values, (_, genres) in zip(rows, cleaned):
+    for name in set(genres):
+      if name in by_name:
+        links.append({owner_key: values['id'], 'genre_id': by_name[name]})
+      else:
+        unknown += 1
+  if links:
+    db.session.execute(association.__table__.insert(), links)
+  return unknown
+
+def import_file(kind, path, chunk_size=DEFAULT_CHUNK_SIZE, fmt=None, progress=None):
+  # Imports every record of path as `kind`; returns (rows imported, unknown genre names skipped, seconds)
+  model, association, owner_key = IMPORTABLE[kind]
+  started = time.perf_counter()
+  total = unknown = 0
+  floor = 0
+  if association is not None:
+    floor = max_explicit_id(path, fmt)
+    reserve_ids(model.__table__, floor)
+  for chunk in chunked(read_rows(path, fmt), chunk_size):
+    try:
+      unknown += insert_chunk(model, association, owner_key, chunk, floor)
+      db.session.commit()
+    except Exception:
+      db.session.rollback()
+      raise
+    total += len(chunk)
+    if progress:
+      progress(total, time.perf_counter() - started)
+  if association is None:
+    # executemany bypasses the Show events that keep the upcoming counters in step
+    refresh_upcoming_show_counts()
+  # Bulk inserts touch pages for ids the session never saw; start the page cache over
+  # (only this process's pages under the 'lru' backend, see above)
+  page_cache.clear()
+  return total, unknown, time.perf_counter() - started
+
+@click.command('import-data')
+@click.argument('kind', type=click.Choice(sorted(IMPORTABLE)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--chunk-size', default=DEFAULT_CHUNK_SIZE, show_default=True, help='Rows per INSERT batch and commit.')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']), help='Defaults to the file extension.')
+@with_appcontext
+def import_data_command(kind, path, chunk_size, fmt):
+  """Bulk-load venues, artists or shows from a CSV or NDJSON file."""
+  def progress(total, seconds):
+    click.echo('%s: %d rows (%.0f rows/s)' % (kind, total, total / seconds if seconds else 0))
+  total, unknown, seconds = import_file(kind, path, chunk_size, fmt, progress)
+  click.echo('Imported %d %s in %.1fs (%.0f rows/s)' % (total, kind, seconds, total / seconds if seconds else 0))
+  if unknown:
+    click.echo('Skipped %d unknown genre name(s)' % unknown)
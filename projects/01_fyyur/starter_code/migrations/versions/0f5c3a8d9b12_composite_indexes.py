@@ -0,0 +1,30 @@
+"""composite indexes for show, venue area and genre lookups
+
+Revision ID: 0f5c3a8d9b12
+Revises: b41f0c9e27d3
+Create Date: 2026-10-18 19:20:11.930442
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0f5c3a8d9b12'
+down_revision = 'b41f0c9e27d3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_shows_artist_id_start_time', 'shows', ['artist_id', 'start_time'], unique=False)
+    op.create_index('ix_shows_start_time_key', 'shows', ['start_time', 'venue_id', 'artist_id'], unique=False)
+    op.create_index('ix_venues_state_city_name', 'venues', ['state', 'city', 'name'], unique=False)
+    op.create_index('ix_genre_venue_venue_id', 'genre_venue', ['venue_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_genre_venue_venue_id', table_name='genre_venue')
+    op.drop_index('ix_venues_state_city_name', table_name='venues')
+    op.drop_index('ix_shows_start_time_key', table_name='shows')
+    op.drop_index('ix_shows_artist_id_start_time', table_name='shows')
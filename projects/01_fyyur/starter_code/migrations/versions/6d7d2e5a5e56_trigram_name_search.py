@@ -0,0 +1,33 @@
+"""trigram indexes for venue and artist name search
+
+Revision ID: 6d7d2e5a5e56
+Revises: 3a1f9c2e7b40
+Create Date: 2026-10-18 17:52:04.118367
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6d7d2e5a5e56'
+down_revision = '3a1f9c2e7b40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # pg_trgm GIN indexes serve ILIKE '%term%' and similarity() ranking without a sequential scan.
+    # Other dialects (SQLite for local testing) get their FTS5 tables from search.create_search_indexes().
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index('ix_venues_name_trgm', 'venues', ['name'], postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+    op.create_index('ix_artists_name_trgm', 'artists', ['name'], postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.drop_index('ix_artists_name_trgm', table_name='artists')
+    op.drop_index('ix_venues_name_trgm', table_name='venues')
@@ -0,0 +1,29 @@
+"""upcoming show counters on venues and artists
+
+Revision ID: b41f0c9e27d3
+Revises: 6d7d2e5a5e56
+Create Date: 2026-10-18 18:41:37.502861
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b41f0c9e27d3'
+down_revision = '6d7d2e5a5e56'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('venues', sa.Column('num_upcoming_shows', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('artists', sa.Column('num_upcoming_shows', sa.Integer(), server_default='0', nullable=False))
+    # Backfill; from here on the app keeps the counters up to date
+    op.execute('UPDATE venues SET num_upcoming_shows = (SELECT COUNT(*) FROM shows WHERE shows.venue_id = venues.id AND shows.start_time >= CURRENT_DATE)')
+    op.execute('UPDATE artists SET num_upcoming_shows = (SELECT COUNT(*) FROM shows WHERE shows.artist_id = artists.id AND shows.start_time >= CURRENT_DATE)')
+
+
+def downgrade():
+    op.drop_column('artists', 'num_upcoming_shows')
+    op.drop_column('venues', 'num_upcoming_shows')
@@ -3,7 +3,11 @@ from flask import Flask
 from flask_moment import Moment
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
-from sqlalchemy import func
+from sqlalchemy import func, tuple_, event
+from sqlalchemy.orm import joinedload, selectinload, validates
+import dateutil.parser
+from itertools import groupby
+from datetime import date, datetime
 
 app = Flask(__name__)
 moment = Moment(app)
@@ -17,8 +21,15 @@ migrate = Migrate(app, db)
 # Models.
 #----------------------------------------------------------------------------#
 
+def start_of_today():
+  # Python-side equivalent of func.current_date(), used to split past and upcoming shows
+  return datetime.combine(date.today(), datetime.min.time())
+
 class Venue(db.Model):
     __tablename__ = 'venues'
+    __table_args__ = (
+      db.Index('ix_venues_state_city_name', 'state', 'city', 'name'), # /venues groups and orders by area
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
@@ -32,29 +43,49 @@ class Venue(db.Model):
     website = db.Column(db.String(120))
     seeking_talent = db.Column(db.Boolean())
     seeking_description = db.Column(db.String(1000), nullable = True)
+    # Maintained by the Show events below and by refresh_upcoming_show_counts()
+    num_upcoming_shows = db.Column(db.Integer, nullable = False, default = 0, server_default = '0')
     shows = db.relationship('Show', backref='venue', lazy=True, cascade = 'delete-orphan')
     genres = db.relationship('GenreVenue', backref='venue', lazy=True, cascade = 'delete-orphan')
 
-    def upcoming_shows(self):
-      shows = db.session.query(Show).filter(Show.venue_id == self.id).filter(Show.start_time >= func.current_date()).all()
-      for s in shows:
-        artist = Artist.query.get(s.artist_id)
-        s.artist_name = artist.name
-        s.artist_image_link = artist.image_link
-        s.start_time = str(s.start_time)
-      return shows
-    def past_shows(self):
-      shows = db.session.query(Show).filter(Show.venue_id == self.id).filter(Show.start_time < func.current_date()).all()
-      for s in shows:
-        artist = Artist.query.get(s.artist_id)
-        s.artist_name = artist.name
-        s.artist_image_link = artist.image_link
-        s.start_time = str(s.start_time)
-      return shows
+    @classmethod
+    def get_with_shows(cls, venue_id):
+      # Loads the venue, its shows with their artists and its genres in a fixed number of queries
+      return cls.query.options(
+        selectinload(cls.shows).joinedload(Show.artist),
+        selectinload(cls.genres)
+      ).filter(cls.id == venue_id).one_or_none()
+    def split_shows(self, since=None):
+      # Returns (past_shows, upcoming_shows) split around one timestamp, defaulting to the start of today
+      since = since or start_of_today()
+      past_shows, upcoming_shows = [], []
+      for s in sorted(self.shows, key=lambda s: s.start_time):
+        show = {
+          'artist_id' : s.artist_id,
+          'artist_name' : s.artist.name,
+          'artist_image_link' : s.artist.image_link,
+          'start_time' : s.start_time
+        }
+        (upcoming_shows if s.start_time >= since else past_shows).append(show)
+      return past_shows, upcoming_shows
+    def genre_names(self):
+      return genre_cache.names(g.genre_id for g in self.genres)
     def upcoming_show_count(self):
-      return len(self.upcoming_shows())
+      return Show.query.filter(Show.venue_id == self.id).filter(Show.start_time >= func.current_date()).count()
     def past_show_count(self):
-      return len(self.past_shows())
+      return Show.query.filter(Show.venue_id == self.id).filter(Show.start_time < func.current_date()).count()
+
+    @classmethod
+    def areas(cls):
+      # Every venue with its stored upcoming show count, ordered so rows of the same city/state are adjacent
+      rows = db.session.query(cls.id, cls.name, cls.city, cls.state, cls.num_upcoming_shows) \
+        .order_by(cls.state, cls.city, cls.name) \
+        .all()
+      areas = []
+      for (city, state), area_rows in groupby(rows, key=lambda r: (r.city, r.state)):
+        venues = [{'id' : r.id, 'name' : r.name, 'num_upcoming_shows' : r.num_upcoming_shows} for r in area_rows]
+        areas.append({'city' : city, 'state' : state, 'venues' : venues})
+      return areas
     
     def __repr__(self):
       return f'<Venue ID: {self.id}, Name: {self.name}>'
@@ -76,6 +107,8 @@ class Artist(db.Model):
     website = db.Column(db.String(120))
     seeking_venue = db.Column(db.Boolean())
     seeking_description = db.Column(db.String(1000), nullable = True)
+    # Maintained by the Show events below and by refresh_upcoming_show_counts()
+    num_upcoming_shows = db.Column(db.Integer, nullable = False, default = 0, server_default = '0')
     # past_shows = derived
     # upcoming_shows = derived
     # past_shows_count = derived
@@ -83,33 +116,112 @@ class Artist(db.Model):
     shows = db.relationship('Show', backref='artist', lazy=True, cascade = 'delete-orphan')
     genres = db.relationship('ArtistGenre', backref='artist', lazy=True, cascade = 'delete-orphan')
 
-    def upcoming_shows(self):
-      shows = db.session.query(Show).filter(Show.artist_id == self.id).filter(Show.start_time >= func.current_date()).all()
-      for s in shows:
-        venue = Venue.query.get(s.venue_id)
-        s.venue_name = venue.name
-        s.venue_image_link = venue.image_link
-        s.start_time = str(s.start_time)
-      return shows
-    def past_shows(self):
-      shows = db.session.query(Show).filter(Show.artist_id == self.id).filter(Show.start_time < func.current_date()).all()
-      for s in shows:
-        venue = Venue.query.get(s.venue_id)
-        s.venue_name = venue.name
-        s.venue_image_link = venue.image_link
-        s.start_time = str(s.start_time)
-      return shows
+    @classmethod
+    def get_with_shows(cls, artist_id):
+      # Loads the artist, its shows with their venues and its genres in a fixed number of queries
+      return cls.query.options(
+        selectinload(cls.shows).joinedload(Show.venue),
+        selectinload(cls.genres)
+      ).filter(cls.id == artist_id).one_or_none()
+    def split_shows(self, since=None):
+      # Returns (past_shows, upcoming_shows) split around one timestamp, defaulting to the start of today
+      since = since or start_of_today()
+      past_shows, upcoming_shows = [], []
+      for s in sorted(self.shows, key=lambda s: s.start_time):
+        show = {
+          'venue_id' : s.venue_id,
+          'venue_name' : s.venue.name,
+          'venue_image_link' : s.venue.image_link,
+          'start_time' : s.start_time
+        }
+        (upcoming_shows if s.start_time >= since else past_shows).append(show)
+      return past_shows, upcoming_shows
+    def genre_names(self):
+      return genre_cache.names(g.genre_id for g in self.genres)
 
     # DONE: implement any missing fields, as a database migration using Flask-Migrate
 
 class Show(db.Model):
   __tablename__ = 'shows'
+  # The primary key already serves lookups by venue_id
+  __table_args__ = (
+    db.Index('ix_shows_artist_id_start_time', 'artist_id', 'start_time'), # artist pages and counters
+    db.Index('ix_shows_start_time_key', 'start_time', 'venue_id', 'artist_id'), # listing order, keyset and date range
+  )
 
   venue_id = db.Column(db.ForeignKey('venues.id'), primary_key = True)
   artist_id = db.Column(db.ForeignKey('artists.id'), primary_key = True)
   
   start_time = db.Column(db.DateTime(), primary_key = True)
 
+  @validates('start_time')
+  def validate_start_time(self, key, value):
+    # Form posts hand over strings; keep a datetime so the upcoming counters can compare it
+    if isinstance(value, str):
+      value = dateutil.parser.parse(value)
+    return value
+
+  @classmethod
+  def matching(cls, query, search_term='', start=None, end=None):
+    # Applies the artist/venue name search and the start_time range to a query already joined to Artist and Venue
+    if search_term:
+      # Names are matched through the search indexes first, then shows are found by their owner ids
+      from search import name_match_ids
+      query = query.filter(db.or_(cls.artist_id.in_(name_match_ids(Artist, search_term)),
+                                  cls.venue_id.in_(name_match_ids(Venue, search_term))))
+    if start:
+      query = query.filter(cls.start_time >= start)
+    if end:
+      query = query.filter(cls.start_time < end)
+    return query
+
+  @classmethod
+  def count_matching(cls, search_term='', start=None, end=None):
+    query = db.session.query(func.count()).select_from(cls) \
+      .join(Artist, Artist.id == cls.artist_id).join(Venue, Venue.id == cls.venue_id)
+    return cls.matching(query, search_term, start, end).scalar()
+
+  @classmethod
+  def listing(cls, search_term='', start=None, end=None, after=None, limit=None):
+    # Shows joined to their artist and venue in one query, filtered and keyset-paginated in SQL.
+    # after is the (start_time, venue_id, artist_id) key of the last show on the previous page.
+    # Returns (shows, next_key) where next_key is None on the last page.
+    limit = limit or app.config['SHOWS_PER_PAGE']
+    query = db.session.query(
+      cls.venue_id, cls.artist_id, cls.start_time,
+      Artist.name.label('artist_name'), Artist.image_link.label('artist_image_link'),
+      Venue.name.label('venue_name')
+    ).join(Artist, Artist.id == cls.artist_id).join(Venue, Venue.id == cls.venue_id)
+    query = cls.matching(query, search_term, start, end)
+    if after:
+      query = query.filter(tuple_(cls.start_time, cls.venue_id, cls.artist_id) > tuple_(*after))
+    # Fetch one extra row to learn whether another page follows
+    rows = query.order_by(cls.start_time, cls.venue_id, cls.artist_id).limit(limit + 1).all()
+    next_key = None
+    if len(rows) > limit:
+      rows = rows[:limit]
+      next_key = (rows[-1].start_time, rows[-1].venue_id, rows[-1].artist_id)
+    shows = [{
+      'venue_id' : r.venue_id,
+      'venue_name' : r.venue_name,
+      'artist_id' : r.artist_id,
+      'artist_name' : r.artist_name,
+      'artist_image_link' : r.artist_image_link,
+      'start_time' : r.start_time
+    } for r in rows]
+    return shows, next_key
+
+  @staticmethod
+  def encode_key(key):
+    start_time, venue_id, artist_id = key
+    return '%s_%d_%d' % (start_time.isoformat(), venue_id, artist_id)
+
+  @staticmethod
+  def decode_key(cursor):
+    # Raises ValueError for a malformed cursor
+    start_time, venue_id, artist_id = cursor.rsplit('_', 2)
+    return (datetime.fromisoformat(start_time), int(venue_id), int(artist_id))
+
 # DONE Implement Show and Artist models, and complete all model relationships and properties, as a database migration.
 
 class Genre(db.Model): # Defines each genre option. No CRUD interface required...these are hard-coded.
@@ -121,7 +233,130 @@ class Genre(db.Model): # Defines each genre option. No CRUD interface required..
 class ArtistGenre(db.Model): # association table between Artist & Genre
   artist_id = db.Column(db.ForeignKey('artists.id'), primary_key = True)
   genre_id = db.Column(db.ForeignKey('genres.id'), primary_key = True)
+  genre = db.relationship('Genre', lazy=True)
 
 class GenreVenue(db.Model): # association table between Venue & Genre
+  __table_args__ = (
+    db.Index('ix_genre_venue_venue_id', 'venue_id'), # the primary key leads with genre_id
+  )
   genre_id = db.Column(db.ForeignKey('genres.id'), primary_key = True)
   venue_id = db.Column(db.ForeignKey('venues.id'), primary_key = True)
+  genre = db.relationship('Genre', lazy=True)
+
+def sync_genres(association, owner_key, owner_id, genre_ids):
+  # Makes the ArtistGenre/GenreVenue rows of one owner match genre_ids using set differences:
+  # one DELETE ... IN for the removed genres and one multi-row INSERT for the added ones.
+  # Does not commit, so the caller's entity update and the genre changes share a transaction.
+  owner_column = getattr(association, owner_key)
+  current = set(genre_id for (genre_id,) in db.session.query(association.genre_id).filter(owner_column == owner_id))
+  wanted = set(genre_ids)
+  removed = current - wanted
+  added = wanted - current
+  if removed:
+    db.session.query(association) \
+      .filter(owner_column == owner_id) \
+      .filter(association.genre_id.in_(removed)) \
+      .delete(synchronize_session=False)
+  if added:
+    db.session.execute(association.__table__.insert().values([{owner_key: owner_id, 'genre_id': g} for g in sorted(added)]))
+  return added, removed
+
+#----------------------------------------------------------------------------#
+# Upcoming show counters.
+#----------------------------------------------------------------------------#
+
+# Venue.num_upcoming_shows and Artist.num_upcoming_shows are bumped in the same transaction
+# as every ORM insert, update or delete of a Show. A show stops being upcoming when the date
+# changes, so all counters are recomputed once a day by `flask refresh-show-counts` (run it
+# from cron just after midnight); requests only read them. Bulk SQL on the shows table
+# bypasses the events and must call the refresh.
+
+def refresh_upcoming_show_counts(since=None):
+  # Recomputes every counter with one UPDATE per table
+  since = since or start_of_today()
+  for model, owner_column in ((Venue, Show.venue_id), (Artist, Show.artist_id)):
+    upcoming = db.session.query(func.count(Show.start_time)) \
+      .filter(owner_column == model.id) \
+      .filter(Show.start_time >= since) \
+      .correlate(model) \
+      .as_scalar()
+    db.session.query(model).update({model.num_upcoming_shows: upcoming}, synchronize_session=False)
+  db.session.commit()
+
+def _bump_upcoming(connection, venue_id, artist_id, start_time, delta):
+  if start_time is None or start_time < start_of_today():
+    return
+  for model, owner_id in ((Venue, venue_id), (Artist, artist_id)):
+    table = model.__table__
+    connection.execute(table.update().where(table.c.id == owner_id).values(num_upcoming_shows=table.c.num_upcoming_shows + delta))
+
+def _show_inserted(mapper, connection, target):
+  _bump_upcoming(connection, target.venue_id, target.artist_id, target.start_time, 1)
+
+def _show_deleted(mapper, connection, target):
+  _bump_upcoming(connection, target.venue_id, target.artist_id, target.start_time, -1)
+
+def _show_updated(mapper, connection, target):
+  state = db.inspect(target)
+  keys = ('venue_id', 'artist_id', 'start_time')
+  if not any(state.attrs[k].history.has_changes() for k in keys):
+    return
+  old = [state.attrs[k].history.deleted[0] if state.attrs[k].history.deleted else getattr(target, k) for k in keys]
+  _bump_upcoming(connection, *old, delta=-1)
+  _bump_upcoming(connection, target.venue_id, target.artist_id, target.start_time, 1)
+
+event.listen(Show, 'after_insert', _show_inserted)
+event.listen(Show, 'after_delete', _show_deleted)
+event.listen(Show, 'after_update', _show_updated)
+
+#----------------------------------------------------------------------------#
+# Genre cache.
+#----------------------------------------------------------------------------#
+
+class GenreCache(object):
+  # Process-wide, bidirectional name <-> id lookup for the static genres table.
+  # Loaded on first use (app.py warms it before the first request) and dropped whenever
+  # a Genre row is flushed or committed; call invalidate() after bulk SQL on the table.
+
+  def __init__(self):
+    self._maps = None # (by_id, by_name), replaced as a whole so readers never see a half-built cache
+
+  def load(self):
+    rows = db.session.query(Genre.id, Genre.name).order_by(Genre.name).all()
+    self._maps = ({r.id: r.name for r in rows}, {r.name: r.id for r in rows})
+    return self._maps
+
+  def invalidate(self):
+    self._maps = None
+
+  def _get(self):
+    return self._maps or self.load()
+
+  def name(self, genre_id):
+    return self._get()[0][genre_id]
+  def id(self, name):
+    return self._get()[1][name]
+  def names(self, genre_ids):
+    by_id = self._get()[0]
+    return [by_id[i] for i in genre_ids]
+  def ids(self, names):
+    by_name = self._get()[1]
+    return [by_name[n] for n in names]
+  def all(self):
+    # [(id, name)] ordered by name
+    return list(self._get()[0].items())
+
+genre_cache = GenreCache()
+
+def _genres_changed(mapper, connection, target):
+  genre_cache.invalidate()
+  db.session.info['genres_changed'] = True
+
+for _event in ('after_insert', 'after_update', 'after_delete'):
+  event.listen(Genre, _event, _genres_changed)
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_genres_after_commit(session):
+  # A reader may have reloaded the cache between the flush and the commit
+  if session.info.pop('genres_changed', False):
+    genre_cache.invalidate()
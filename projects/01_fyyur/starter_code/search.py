@@ -0,0 +1,96 @@
+#----------------------------------------------------------------------------#
+# Ranked name search for venues and artists.
+#
+# PostgreSQL: ILIKE '%term%' served by the pg_trgm GIN indexes added in
+# migrations/versions/6d7d2e5a5e56, ranked by trigram similarity().
+# SQLite (local testing): FTS5 tables with the trigram tokenizer, kept in
+# sync with the base tables by triggers and ranked by bm25.
+# The indexes are schema, never built by a request: run `flask db upgrade`
+# (PostgreSQL) or `flask create-search-indexes` (any database). SQLite
+# without the FTS5 tables falls back to an unranked ILIKE.
+#----------------------------------------------------------------------------#
+
+from sqlalchemy import bindparam, func, literal_column, select, table, text
+from models import db, Venue, Artist
+
+SEARCHABLE_TABLES = ['venues', 'artists']
+# Trigram matching needs at least three characters; shorter terms fall back to a plain ILIKE
+MIN_TRIGRAM_LENGTH = 3
+
+_fts_available = {} # SQLite database url -> whether the FTS5 tables exist
+
+def create_search_indexes():
+  # Idempotent; run once per database, not while serving. PostgreSQL deployments normally get these from `flask db upgrade`.
+  dialect = db.engine.dialect.name
+  if dialect == 'postgresql':
+    db.session.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+    for table in SEARCHABLE_TABLES:
+      db.session.execute(text('CREATE INDEX IF NOT EXISTS ix_{0}_name_trgm ON {0} USING gin (name gin_trgm_ops)'.format(table)))
+  elif dialect == 'sqlite':
+    for table in SEARCHABLE_TABLES:
+      db.session.execute(text("CREATE VIRTUAL TABLE IF NOT EXISTS {0}_fts USING fts5(name, content='{0}', content_rowid='id', tokenize='trigram')".format(table)))
+      db.session.execute(text("""CREATE TRIGGER IF NOT EXISTS {0}_fts_ai AFTER INSERT ON {0} BEGIN
+        INSERT INTO {0}_fts(rowid, name) VALUES (new.id, new.name);
+      END""".format(table)))
+      db.session.execute(text("""CREATE TRIGGER IF NOT EXISTS {0}_fts_ad AFTER DELETE ON {0} BEGIN
+        INSERT INTO {0}_fts({0}_fts, rowid, name) VALUES ('delete', old.id, old.name);
+      END""".format(table)))
+      db.session.execute(text("""CREATE TRIGGER IF NOT EXISTS {0}_fts_au AFTER UPDATE OF name ON {0} BEGIN
+        INSERT INTO {0}_fts({0}_fts, rowid, name) VALUES ('delete', old.id, old.name);
+        INSERT INTO {0}_fts(rowid, name) VALUES (new.id, new.name);
+      END""".format(table)))
+      # Re-index from the base table in case it was recreated underneath the FTS table
+      db.session.execute(text("INSERT INTO {0}_fts({0}_fts) VALUES ('rebuild')".format(table)))
+    _fts_available[str(db.engine.url)] = True
+  db.session.commit()
+
+def has_fts_tables():
+  # Read once per process and database; a schema lookup, never DDL
+  url = str(db.engine.url)
+  if url not in _fts_available:
+    names = ['{0}_fts'.format(table) for table in SEARCHABLE_TABLES]
+    found = db.session.execute(text('SELECT count(*) FROM sqlite_master WHERE name IN :names')
+      .bindparams(bindparam('names', expanding=True)), {'names': names}).scalar()
+    _fts_available[url] = found == len(names)
+  return _fts_available[url]
+
+def use_fts(search_term):
+  return db.engine.dialect.name == 'sqlite' and len(search_term) >= MIN_TRIGRAM_LENGTH and has_fts_tables()
+
+def search_names(model, search_term, limit=None):
+  # Returns model rows whose name contains search_term (case-insensitive), best matches first
+  search_term = search_term.strip()
+  dialect = db.engine.dialect.name
+  if use_fts(search_term):
+    return _search_fts(model, search_term, limit)
+  query = model.query.filter(model.name.ilike('%' + search_term + '%'))
+  if dialect == 'postgresql' and search_term:
+    query = query.order_by(func.similarity(model.name, search_term).desc(), model.name)
+  else:
+    query = query.order_by(model.name)
+  if limit:
+    query = query.limit(limit)
+  return query.all()
+
+def _search_fts(model, search_term, limit):
+  fts = model.__tablename__ + '_fts'
+  # Quote the term so FTS5 treats it as one substring rather than query syntax
+  match = '"' + search_term.replace('"', '""') + '"'
+  sql = 'SELECT rowid FROM {0} WHERE {0} MATCH :match ORDER BY rank'.format(fts)
+  if limit:
+    sql += ' LIMIT %d' % limit
+  ids = [row[0] for row in db.session.execute(text(sql), {'match': match})]
+  if not ids:
+    return []
+  by_id = {m.id: m for m in model.query.filter(model.id.in_(ids))}
+  return [by_id[i] for i in ids if i in by_id]
+
+def name_match_ids(model, search_term):
+  # A subquery of the ids of model rows whose name contains search_term, served by the same indexes as search_names
+  search_term = search_term.strip()
+  if use_fts(search_term):
+    fts = model.__tablename__ + '_fts'
+    match = '"' + search_term.replace('"', '""') + '"'
+    return select([literal_column('rowid')]).select_from(table(fts)) \
+      .where(text('{0} MATCH :match'.format(fts)).bindparams(match=match))
+  return select([model.id]).where(model.name.ilike('%' + search_term + '%'))
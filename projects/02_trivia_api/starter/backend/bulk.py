@@ -0,0 +1,204 @@
+'''
+Bulk import and export of questions as NDJSON or CSV.
+
+    flask import-questions questions.ndjson --chunk-size 5000
+    flask export-questions questions.csv
+
+The same functions back POST /api/questions/import and
+GET /api/questions/export. Input is read one line at a time and inserted
+one chunk per INSERT (executemany) and commit; export reads through a
+server-side cursor, so neither side holds the bank in memory.
+Question ids are not imported: rows get new ids from the database.
+'''
+import csv
+import io
+import json
+import resource
+import sys
+import time
+from itertools import islice
+
+import click
+from flask.cli import with_appcontext
+
+from models import db, Question, category_cache, stats_cache
+
+DEFAULT_CHUNK_SIZE = 1000
+EXPORT_BATCH_SIZE = 1000
+FIELDS = ['id', 'question', 'answer', 'category', 'difficulty']
+DIFFICULTIES = range(1, 6)
+# Rejected rows reported back in detail; the rest are only counted
+MAX_REPORTED_ERRORS = 50
+
+
+def read_rows(lines, fmt):
+    # Yields (line number, dict) for each record of an iterable of lines
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield number, row
+
+
+def validate_row(row, category_ids):
+    '''
+    Returns the column values for a record, or raises ValueError naming
+    the first problem found
+    '''
+    if not isinstance(row, dict):
+        raise ValueError('not a JSON object')
+    values = {}
+    for field in ('question', 'answer'):
+        value = row.get(field)
+        if not isinstance(value, str) or not value.strip():
+            raise ValueError('%s is required' % field)
+        values[field] = value.strip()
+    for field in ('category', 'difficulty'):
+        try:
+            values[field] = int(row.get(field))
+        except (TypeError, ValueError):
+            raise ValueError('%s must be an integer' % field)
+    if values['category'] not in category_ids:
+        raise ValueError('unknown category %d' % values['category'])
+    if values['difficulty'] not in DIFFICULTIES:
+        raise ValueError('difficulty must be between 1 and 5')
+    return values
+
+
+def peak_memory_kb():
+    # Peak resident set size of this process (ru_maxrss is bytes on macOS)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def import_questions(lines, fmt='ndjson', chunk_size=DEFAULT_CHUNK_SIZE):
+    '''
+    Validates and inserts every record read from lines (an iterable of
+    text lines). Valid rows are kept even when others are rejected.
+    Returns a summary dict: imported, rejected, errors (the first
+    MAX_REPORTED_ERRORS as {line, error}), seconds, rows_per_second and
+    peak_memory_kb.
+    '''
+    started = time.perf_counter()
+    category_ids = set(category['id'] for category in category_cache.get())
+    insert = Question.__table__.insert()
+    imported = rejected = 0
+    errors = []
+    rows = read_rows(lines, fmt)
+    while True:
+        batch = list(islice(rows, chunk_size))
+        if not batch:
+            break
+        chunk = []
+        for number, row in batch:
+            try:
+                chunk.append(validate_row(row, category_ids))
+            except ValueError as error:
+                rejected += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append({'line': number, 'error': str(error)})
+        if chunk:
+            try:
+                db.session.execute(insert, chunk)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            imported += len(chunk)
+    # executemany skips the ORM events that keep the stats current
+    if imported:
+        stats_cache.invalidate()
+    seconds = time.perf_counter() - started
+    return {
+        'imported': imported,
+        'rejected': rejected,
+        'errors': errors,
+        'seconds': round(seconds, 3),
+        'rows_per_second': round(imported / seconds) if seconds else 0,
+        'peak_memory_kb': peak_memory_kb()
+    }
+
+
+def export_questions(fmt='ndjson', batch_size=EXPORT_BATCH_SIZE):
+    '''
+    Yields the question bank in id order as NDJSON or CSV text, one
+    string per batch of rows. On PostgreSQL the rows come from a
+    server-side (named) cursor, batch_size at a time.
+    '''
+    columns = [getattr(Question, field) for field in FIELDS]
+    rows = db.session.query(*columns).order_by(Question.id).execution_options(
+        stream_results=True).yield_per(batch_size)
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(FIELDS)
+        for batch in _batches(rows, batch_size):
+            writer.writerows(batch)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+    else:
+        for batch in _batches(rows, batch_size):
+            yield ''.join(json.dumps(dict(zip(FIELDS, row))) + '\n'
+                          for row in batch)
+
+
+def _batches(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def file_format(path, fmt):
+    return fmt or ('csv' if path.endswith('.csv') else 'ndjson')
+
+
+@click.command('import-questions')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--chunk-size', default=DEFAULT_CHUNK_SIZE, show_default=True,
+              help='Rows per INSERT batch and commit.')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']),
+              help='Defaults to the file extension.')
+@with_appcontext
+def import_questions_command(path, chunk_size, fmt):
+    """Bulk-load questions from an NDJSON or CSV file."""
+    with open(path, newline='', encoding='utf-8') as f:
+        summary = import_questions(f, file_format(path, fmt), chunk_size)
+    click.echo('Imported %(imported)d questions in %(seconds).1fs '
+               '(%(rows_per_second)d rows/s, peak memory %(peak_memory_kb)d KB)'
+               % summary)
+    if summary['rejected']:
+        click.echo('Rejected %d row(s):' % summary['rejected'])
+        for error in summary['errors']:
+            click.echo('  line %(line)d: %(error)s' % error)
+
+
+@click.command('export-questions')
+@click.argument('path', type=click.Path(dir_okay=False, writable=True))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']),
+              help='Defaults to the file extension.')
+@with_appcontext
+def export_questions_command(path, fmt):
+    """Write every question to an NDJSON or CSV file."""
+    started = time.perf_counter()
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        for text in export_questions(file_format(path, fmt)):
+            f.write(text)
+    seconds = time.perf_counter() - started
+    total = db.session.query(db.func.count(Question.id)).scalar()
+    click.echo('Exported %d questions in %.1fs (%d rows/s, peak memory %d KB)'
+               % (total, seconds, total / seconds if seconds else 0,
+                  peak_memory_kb()))
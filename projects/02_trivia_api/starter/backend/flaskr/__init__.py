@@ -1,12 +1,19 @@
+import io
 import os
-from flask import Flask, request, abort, jsonify
+from flask import Flask, request, abort, jsonify, Response, \
+    stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS, cross_origin
 import random
 
-from models import db, setup_db, Question, Category
+from models import db, setup_db, count_rows, Question, Category, \
+    category_cache, stats_cache
+import bulk
+import search
+from .quizzes import MAX_DECK_SIZE, quiz_store
 
 QUESTIONS_PER_PAGE = 10
+MAX_QUESTIONS_PER_PAGE = 100
 
 
 def create_app(test_config=None):
@@ -19,10 +26,34 @@ def create_app(test_config=None):
     Delete the sample route after completing the TO-DOs
     '''
     cors = CORS(app, resources={r"/api/*": {"origins": "*"}})
+    app.cli.add_command(bulk.import_questions_command)
+    app.cli.add_command(bulk.export_questions_command)
+    app.cli.add_command(search.create_search_index_command)
 
     '''
     @DONE: Use the after_request decorator to set Access-Control-Allow
     '''
+    def category_param(value):
+        # Optional category id from a request body; 422 unless an integer
+        if value is None:
+            return None
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            abort(422)
+
+    def histogram(counts):
+        # Question count per difficulty, with every level from 1 to 5 present
+        levels = dict((level, 0) for level in range(1, 6))
+        levels.update(counts)
+        return dict((str(level), count) for level, count in levels.items()
+                    if level is not None)
+
+    def conditional(response):
+        # Strong ETag over the body; a matching If-None-Match gets an empty 304
+        response.add_etag()
+        return response.make_conditional(request)
+
     @app.after_request
     def after_request(response):
         response.headers.add('Access-Control-Allow-Headers',
@@ -38,13 +69,12 @@ def create_app(test_config=None):
     @app.route('/api/categories', methods=['GET'])
     # @cross_origin()
     def retrieve_categories():
-        categories = Category.query.all()
-        formatted_categories = [category.format() for category in categories]
-        return jsonify({
+        formatted_categories = category_cache.get()
+        return conditional(jsonify({
             "success": True,
             "categories": formatted_categories,
             "total_categories": len(formatted_categories)
-        })
+        }))
 
     '''
     @DONE: 
@@ -62,24 +92,29 @@ def create_app(test_config=None):
     @app.route('/api/questions', methods=['GET'])
     # @cross_origin()
     def retrieve_questions():
-        # Retrieve page argument from request to specify which plants to return
+        # ?page=N pages with LIMIT/OFFSET; ?after=<id> (the next_cursor of the
+        # previous response) seeks past that id instead, which stays cheap
+        # however deep the client pages. ?per_page defaults to
+        # QUESTIONS_PER_PAGE and is capped at MAX_QUESTIONS_PER_PAGE.
         page = request.args.get('page', 1, type=int)
-        pageSize = 10
-        start = (page - 1) * pageSize
-        end = start + pageSize
+        per_page = request.args.get('per_page', QUESTIONS_PER_PAGE, type=int)
+        after = request.args.get('after', None, type=int)
+        if page < 1 or not 1 <= per_page <= MAX_QUESTIONS_PER_PAGE:
+            abort(422)
 
-        categories = Category.query.all()
-        formatted_categories = [category.format() for category in categories]
+        formatted_categories = category_cache.get()
 
-        questions = Question.query.all()
+        questions, next_cursor = Question.page(per_page, page, after)
         formatted_questions = [question.format() for question in questions]
-        return jsonify({
+        return conditional(jsonify({
             "success": True,
-            "questions": formatted_questions[start:end],
+            "questions": formatted_questions,
             "categories": formatted_categories,
-            "total_questions": len(formatted_questions),
-
-        })
+            "total_questions": count_rows(Question),
+            "page": page if after is None else None,
+            "per_page": per_page,
+            "next_cursor": next_cursor
+        }))
 
     '''
   @DONE: 
@@ -121,7 +156,7 @@ def create_app(test_config=None):
         try:
             question = request.json['question']
             answer = request.json['answer']
-            category = request.json['category']
+            category = int(request.json['category'])
             difficulty = request.json['difficulty']
             new_question = Question(
                 question=question, answer=answer,
@@ -137,6 +172,30 @@ def create_app(test_config=None):
             db.session.close()
             return jsonify(response)
 
+    '''
+  Bulk import and export, see bulk.py. Import reads the request body as it
+  arrives: NDJSON, or CSV when sent as text/csv.
+  '''
+    @app.route('/api/questions/import', methods=['POST'])
+    def import_questions():
+        chunk_size = request.args.get(
+            'chunk_size', bulk.DEFAULT_CHUNK_SIZE, type=int)
+        if chunk_size < 1:
+            abort(422)
+        fmt = 'csv' if request.mimetype == 'text/csv' else 'ndjson'
+        lines = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+        summary = bulk.import_questions(lines, fmt, chunk_size)
+        return jsonify(dict(summary, success=True))
+
+    @app.route('/api/questions/export', methods=['GET'])
+    def export_questions():
+        fmt = request.args.get('format', 'ndjson')
+        if fmt not in ('ndjson', 'csv'):
+            abort(422)
+        return Response(
+            stream_with_context(bulk.export_questions(fmt)),
+            mimetype='text/csv' if fmt == 'csv' else 'application/x-ndjson')
+
     '''
   @DONE: 
   Create a POST endpoint to get questions based on a search term. 
@@ -150,15 +209,26 @@ def create_app(test_config=None):
     @app.route('/api/questions/search', methods=['POST'])
     # @cross_origin()
     def search_questions():
-        search_term = request.json['searchTerm']
-        relevant_questions = db.session.query(Question).filter(
-            Question.question.ilike('%' + search_term + '%')).all()
-        formatted_questions = [question.format()
-                               for question in relevant_questions]
+        # Ranked full-text search over question and answer text, see
+        # search.py. Optional: category, page, per_page
+        body = request.get_json(silent=True) or {}
+        search_term = body.get('searchTerm')
+        page = body.get('page', 1)
+        per_page = body.get('per_page', QUESTIONS_PER_PAGE)
+        if (not isinstance(search_term, str) or
+                not isinstance(page, int) or page < 1 or
+                not isinstance(per_page, int) or
+                not 1 <= per_page <= MAX_QUESTIONS_PER_PAGE):
+            abort(422)
+        category_id = category_param(body.get('category'))
+        formatted_questions, total = search.search_questions(
+            search_term, category_id, page, per_page)
         return jsonify({
             "success": True,
             "questions": formatted_questions,
-            "total_questions": len(formatted_questions)
+            "total_questions": total,
+            "page": page,
+            "per_page": per_page
         })
 
     '''
@@ -172,7 +242,6 @@ def create_app(test_config=None):
     @app.route('/api/categories/<int:category_id>/questions', methods=['GET'])
     # @cross_origin()
     def retrieve_category_questions(category_id):
-        category_id = str(category_id)
         relevant_questions = Question.query.filter_by(
             category=category_id).all()
         formatted_questions = [question.format()
@@ -197,29 +266,14 @@ def create_app(test_config=None):
   '''
     @app.route('/api/play', methods=['POST'])
     def play():
-        if 'quizCategory' in request.json:
-            category_id = str(request.json['quizCategory'])
-        else:
-            category_id = None
+        category_id = category_param(request.json.get('quizCategory'))
         if 'previousQuestions' in request.json:
             previous_question_ids = request.json['previousQuestions']
         else:
             previous_question_ids = None
-        if category_id and previous_question_ids:
-            relevant_questions = db.session.query(Question).filter(
-                Question.id.notin_(previous_question_ids)
-            ).filter(Question.category == category_id).all()
-        elif previous_question_ids:
-            relevant_questions = db.session.query(Question).filter(
-                Question.id.notin_(previous_question_ids)).all()
-        elif category_id:
-            relevant_questions = db.session.query(Question).filter(
-                Question.category == category_id).all()
-        else:
-            relevant_questions = db.session.query(Question).all()
-
-        if len(relevant_questions) > 0:
-            chosen_question = random.choice(relevant_questions)
+        chosen_question = Question.pick_random(
+            category_id, previous_question_ids or ())
+        if chosen_question is not None:
             formatted_question = chosen_question.format()
             return jsonify({
                 "success": True,
@@ -232,6 +286,78 @@ def create_app(test_config=None):
                 # "requestData":request # This causes a fatal error. Something in request is not json serialized
             })
 
+    '''
+  Per-category question counts and difficulty histograms for dashboards,
+  from one cached GROUP BY query.
+  '''
+    @app.route('/api/stats', methods=['GET'])
+    def retrieve_stats():
+        stats = stats_cache.get()
+        formatted_categories = []
+        for category in category_cache.get():
+            counts = stats.get(category['id'], {})
+            formatted_categories.append(dict(
+                category,
+                total_questions=sum(counts.values()),
+                difficulty=histogram(counts)))
+        uncategorized = stats.get(None, {})
+        return conditional(jsonify({
+            "success": True,
+            "categories": formatted_categories,
+            "uncategorized": {
+                "total_questions": sum(uncategorized.values()),
+                "difficulty": histogram(uncategorized)
+            },
+            "total_questions": sum(sum(counts.values())
+                                   for counts in stats.values())
+        }))
+
+    '''
+  Quiz sessions: the deck of question ids is shuffled once when the quiz
+  starts and kept on the server, so each draw is one primary key lookup
+  and the client only sends the quiz id back. Decks live in the worker
+  process (see quizzes.py), so serve with a single worker.
+  '''
+    @app.route('/api/quizzes', methods=['POST'])
+    def create_quiz():
+        body = request.get_json(silent=True) or {}
+        category_id = category_param(body.get('quizCategory'))
+        quiz_id, total = quiz_store.create(
+            Question.sample_ids(category_id, MAX_DECK_SIZE))
+        return jsonify({
+            "success": True,
+            "quiz_id": quiz_id,
+            "total_questions": total
+        })
+
+    @app.route('/api/quizzes/<quiz_id>/next', methods=['POST'])
+    def next_quiz_question(quiz_id):
+        while True:
+            drawn = quiz_store.draw(quiz_id)
+            if drawn is None:
+                abort(404)
+            question_id, remaining = drawn
+            if question_id is None:
+                return jsonify({
+                    "success": True,
+                    "question": False,
+                    "remaining": 0
+                })
+            question = Question.query.get(question_id)
+            # Questions deleted since the deck was dealt are skipped
+            if question is not None:
+                return jsonify({
+                    "success": True,
+                    "question": question.format(),
+                    "remaining": remaining
+                })
+
+    @app.route('/api/quizzes/<quiz_id>', methods=['DELETE'])
+    def delete_quiz(quiz_id):
+        if not quiz_store.discard(quiz_id):
+            abort(404)
+        return jsonify({"success": True})
+
     '''
   @DONE: 
   Create error handlers for all expected errors 
@@ -0,0 +1,79 @@
+import random
+import secrets
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+# Seconds a quiz survives without being played
+QUIZ_TTL = 3600
+# Quizzes kept at once; the least recently played are dropped first
+MAX_QUIZZES = 10000
+# Questions dealt into one deck, so a quiz over a huge bank stays small
+MAX_DECK_SIZE = 10000
+
+
+'''
+QuizStore
+    in-process store of quiz decks. A deck is the shuffled ids of the
+    questions a quiz will ask, held as an array of unsigned ints (4 bytes a
+    question) and dealt from the end, so every draw is O(1).
+
+    Decks are not shared between processes: with several workers a draw
+    routed to a worker that did not create the quiz gets a 404. Serve the
+    API from one worker process (threads are fine), e.g.
+    gunicorn -w 1 --threads 8 'flaskr:create_app()'.
+'''
+
+
+class QuizStore:
+    def __init__(self, ttl=QUIZ_TTL, max_quizzes=MAX_QUIZZES):
+        self.ttl = ttl
+        self.max_quizzes = max_quizzes
+        self._quizzes = OrderedDict()  # quiz id -> [expires at, deck]
+        self._lock = threading.Lock()
+
+    def create(self, question_ids, max_deck_size=MAX_DECK_SIZE):
+        question_ids = list(question_ids)
+        if len(question_ids) > max_deck_size:
+            deck = random.sample(question_ids, max_deck_size)
+        else:
+            deck = question_ids
+            random.shuffle(deck)
+        quiz_id = secrets.token_urlsafe(16)
+        with self._lock:
+            self._purge()
+            self._quizzes[quiz_id] = [time.time() + self.ttl,
+                                      array('I', deck)]
+        return quiz_id, len(deck)
+
+    def draw(self, quiz_id):
+        '''
+        Returns (next question id or None once the deck is empty,
+        questions left), or None for an unknown or expired quiz
+        '''
+        with self._lock:
+            entry = self._quizzes.get(quiz_id)
+            if entry is None or entry[0] < time.time():
+                self._quizzes.pop(quiz_id, None)
+                return None
+            entry[0] = time.time() + self.ttl
+            self._quizzes.move_to_end(quiz_id)
+            deck = entry[1]
+            return (deck.pop() if deck else None), len(deck)
+
+    def discard(self, quiz_id):
+        with self._lock:
+            return self._quizzes.pop(quiz_id, None) is not None
+
+    def _purge(self):
+        now = time.time()
+        # Entries are kept in order of last use, so expired ones come first
+        while self._quizzes:
+            quiz_id, (expires_at, _) = next(iter(self._quizzes.items()))
+            if expires_at >= now and len(self._quizzes) < self.max_quizzes:
+                break
+            self._quizzes.popitem(last=False)
+
+
+quiz_store = QuizStore()
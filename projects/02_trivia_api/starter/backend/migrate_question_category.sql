@@ -0,0 +1,40 @@
+--
+-- Turns questions.category into an indexed integer foreign key to categories.
+--
+--   psql trivia < migrate_question_category.sql
+--
+-- Safe to run more than once, on databases restored from trivia.psql (the
+-- column is already an integer there) as well as on ones created by
+-- db.create_all() while Question.category was a String column.
+--
+
+BEGIN;
+
+DO $$
+BEGIN
+    IF (SELECT data_type FROM information_schema.columns
+        WHERE table_name = 'questions' AND column_name = 'category') <> 'integer' THEN
+        -- Backfill: values that are not the id of a category become NULL
+        -- instead of failing the cast or the foreign key
+        UPDATE questions SET category = NULL
+        WHERE category IS NOT NULL
+          AND CASE WHEN category ~ '^\s*\d{1,9}\s*$'
+                   THEN trim(category)::integer NOT IN (SELECT id FROM categories)
+                   ELSE true END;
+        ALTER TABLE questions
+            ALTER COLUMN category TYPE integer USING trim(category)::integer;
+    END IF;
+
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint
+                   WHERE conrelid = 'questions'::regclass AND contype = 'f') THEN
+        ALTER TABLE questions ADD CONSTRAINT category FOREIGN KEY (category)
+            REFERENCES categories(id) ON UPDATE CASCADE ON DELETE SET NULL;
+    END IF;
+END
+$$;
+
+CREATE INDEX IF NOT EXISTS ix_questions_category_id ON questions (category, id);
+
+COMMIT;
+
+ANALYZE questions;
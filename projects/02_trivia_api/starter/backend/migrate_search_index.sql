@@ -0,0 +1,16 @@
+--
+-- Adds the full-text search index behind /api/questions/search.
+--
+--   psql trivia < migrate_search_index.sql
+--
+-- CONCURRENTLY builds the index without blocking writes to questions, so it
+-- can run against a live database; it cannot run inside a transaction.
+-- Safe to run more than once. If a concurrent build is interrupted it
+-- leaves an INVALID index behind: DROP INDEX ix_questions_search and rerun.
+-- The expression must match SEARCH_VECTOR in search.py.
+--
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_questions_search ON questions
+    USING gin (to_tsvector('english', coalesce(question, '') || ' ' || coalesce(answer, '')));
+
+ANALYZE questions;
@@ -1,7 +1,11 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
+from sqlalchemy import Column, String, Integer, ForeignKey, Index, \
+    create_engine, func, text, event
 from flask_sqlalchemy import SQLAlchemy
 import json
+import random
+import threading
+import time
 
 database_dialect = 'postgres'
 database_username = 'postgres'
@@ -41,6 +45,31 @@ def setup_db(app, database_path=database_path):
     db.create_all()
 
 
+'''
+count_rows(model)
+    number of rows in the model's table. On PostgreSQL, tables with more
+    than EXACT_COUNT_LIMIT rows report the planner's estimate
+    (pg_class.reltuples) instead of paying for a full COUNT(*).
+'''
+EXACT_COUNT_LIMIT = 100000
+# Question.pick_random: random seeks to try, and ids read per seek or scan step
+RANDOM_ATTEMPTS = 8
+RANDOM_BATCH = 32
+SCAN_BATCH = 1000
+
+
+def count_rows(model):
+    if db.engine.dialect.name == 'postgresql':
+        estimate = db.session.execute(
+            text("SELECT reltuples::bigint FROM pg_class "
+                 "WHERE oid = CAST(:table AS regclass)"),
+            {'table': model.__tablename__}).scalar()
+        # reltuples is -1 (or 0 on older servers) until the table is analyzed
+        if estimate is not None and estimate > EXACT_COUNT_LIMIT:
+            return estimate
+    return db.session.query(func.count(model.id)).scalar()
+
+
 '''
 Question
 
@@ -49,11 +78,16 @@ Question
 
 class Question(db.Model):
     __tablename__ = 'questions'
+    __table_args__ = (
+        # Per-category listings, decks and random seeks walk this in id order
+        Index('ix_questions_category_id', 'category', 'id'),
+    )
 
     id = Column(Integer, primary_key=True)
     question = Column(String)
     answer = Column(String)
-    category = Column(String)
+    category = Column(Integer, ForeignKey(
+        'categories.id', onupdate='CASCADE', ondelete='SET NULL'))
     difficulty = Column(Integer)
 
     def __init__(self, question, answer, category, difficulty):
@@ -73,6 +107,95 @@ class Question(db.Model):
         db.session.delete(self)
         db.session.commit()
 
+    '''
+    page(per_page, page=1, after=None)
+        one page of questions in id order, LIMITed in SQL. With after (the id
+        of the last question already seen) the page starts with a keyset
+        seek instead of an OFFSET. Returns (questions, id to pass as after
+        for the next page or None on the last page)
+    '''
+    @classmethod
+    def page(cls, per_page, page=1, after=None):
+        query = cls.query.order_by(cls.id)
+        if after is not None:
+            query = query.filter(cls.id > after)
+        else:
+            query = query.offset((page - 1) * per_page)
+        # One extra row tells whether there is a next page without a count
+        questions = query.limit(per_page + 1).all()
+        next_cursor = None
+        if len(questions) > per_page:
+            questions = questions[:per_page]
+            next_cursor = questions[-1].id
+        return questions, next_cursor
+
+    '''
+    sample_ids(category=None, limit=None)
+        ids of up to limit questions, optionally within a category, in
+        random order. The database shuffles and truncates (ORDER BY
+        random() LIMIT), so a large bank is never loaded into the app.
+    '''
+    @classmethod
+    def sample_ids(cls, category=None, limit=None):
+        query = db.session.query(cls.id)
+        if category is not None:
+            query = query.filter(cls.category == category)
+        query = query.order_by(func.random()).limit(limit)
+        return [question_id for (question_id,) in query]
+
+    '''
+    pick_random(category=None, exclude=())
+        a random question, optionally within a category and skipping the ids
+        in exclude, or None when none is left. Draws RANDOM_BATCH random ids
+        between the category's lowest and highest id (both read off the
+        (category, id) index) and looks them up in one primary key query;
+        the first draw that exists, is in the category and is not excluded
+        wins, so every remaining question is equally likely and the cost
+        does not grow with the bank. Exclusions are checked against a set
+        in Python rather than sent to the database as a NOT IN list.
+    '''
+    @classmethod
+    def pick_random(cls, category=None, exclude=()):
+        exclude = set(exclude)
+        ids = db.session.query(cls.id)
+        if category is not None:
+            ids = ids.filter(cls.category == category)
+        # Queried separately: SQLite only optimizes a lone MIN or MAX
+        low = ids.with_entities(func.min(cls.id)).scalar()
+        high = ids.with_entities(func.max(cls.id)).scalar()
+        if low is None:
+            return None
+
+        def first_allowed(lower, upper):
+            # Walks ids in [lower, upper] in order, SCAN_BATCH ids per query
+            while lower <= upper:
+                candidates = [i for (i,) in ids.filter(
+                    cls.id >= lower, cls.id <= upper
+                ).order_by(cls.id).limit(SCAN_BATCH)]
+                for candidate in candidates:
+                    if candidate not in exclude:
+                        return candidate
+                if len(candidates) < SCAN_BATCH:
+                    return None
+                lower = candidates[-1] + 1
+            return None
+
+        chosen = None
+        for _ in range(RANDOM_ATTEMPTS):
+            draws = [random.randint(low, high) for _ in range(RANDOM_BATCH)]
+            found = set(i for (i,) in ids.filter(cls.id.in_(set(draws))))
+            chosen = next((i for i in draws
+                           if i in found and i not in exclude), None)
+            if chosen is not None:
+                break
+        if chosen is None:
+            # Nearly everything is excluded or the ids are very sparse:
+            # walk the whole range once, wrapping around from a random start
+            start = random.randint(low, high)
+            chosen = (first_allowed(start, high) or
+                      first_allowed(low, start - 1))
+        return cls.query.get(chosen) if chosen is not None else None
+
     def format(self):
         return {
             'id': self.id,
@@ -102,4 +225,77 @@ class Category(db.Model):
         return {
             'id': self.id,
             'type': self.type
-        }
\ No newline at end of file
+        }
+
+'''
+QueryCache(load)
+    result of load(), computed once and reused until invalidate() is
+    called after a write (or CACHE_TTL passes, which bounds how long other
+    processes serve data changed elsewhere)
+'''
+CACHE_TTL = 300
+
+
+class QueryCache:
+    def __init__(self, load, ttl=CACHE_TTL):
+        self.load = load
+        self.ttl = ttl
+        self._entry = None  # (loaded at, result)
+        self._lock = threading.Lock()
+
+    def get(self):
+        entry = self._entry
+        if entry is None or entry[0] + self.ttl < time.time():
+            with self._lock:
+                entry = self._entry = (time.time(), self.load())
+        return entry[1]
+
+    def invalidate(self):
+        self._entry = None
+
+
+'''
+question_stats()
+    {category id (None for uncategorized): {difficulty: question count}}
+    from a single GROUP BY over the questions table
+'''
+
+
+def question_stats():
+    stats = {}
+    rows = db.session.query(
+        Question.category, Question.difficulty, func.count(Question.id)
+    ).group_by(Question.category, Question.difficulty)
+    for category, difficulty, count in rows:
+        stats.setdefault(category, {})[difficulty] = count
+    return stats
+
+
+# Formatted categories in id order
+category_cache = QueryCache(lambda: [
+    category.format() for category in Category.query.order_by(Category.id)])
+stats_cache = QueryCache(question_stats)
+
+
+def _categories_changed(mapper, connection, target):
+    db.session.info['categories_changed'] = True
+
+
+def _questions_changed(mapper, connection, target):
+    db.session.info['questions_changed'] = True
+
+
+for _event in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(Category, _event, _categories_changed)
+    event.listen(Question, _event, _questions_changed)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_caches(session):
+    # Only once the write is visible to other sessions
+    if session.info.pop('categories_changed', False):
+        category_cache.invalidate()
+        # Deleting a category also moves its questions to uncategorized
+        stats_cache.invalidate()
+    if session.info.pop('questions_changed', False):
+        stats_cache.invalidate()
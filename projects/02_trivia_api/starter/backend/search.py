@@ -0,0 +1,171 @@
+'''
+Ranked full-text search over question and answer text.
+
+PostgreSQL: an expression GIN index on the english tsvector of both
+columns, ranked with ts_rank and highlighted with ts_headline.
+SQLite (local testing): an FTS5 table kept in sync by triggers, ranked by
+bm25 and highlighted with highlight().
+Other databases, and SQLite without the FTS5 table, fall back to an
+unranked ILIKE on the question text.
+
+The index is schema, not something a request creates: trivia.psql has it,
+migrate_search_index.sql adds it to an existing PostgreSQL database without
+blocking writes, and `flask create-search-index` prepares any database.
+
+Every word of the search term must match, each as a prefix, so "alex"
+finds "Alexander".
+'''
+import re
+
+import click
+from flask.cli import with_appcontext
+from markupsafe import escape
+from sqlalchemy import text
+
+from models import db, Question
+
+# The database marks matches with control characters; the snippet is then
+# HTML-escaped and the marks become <mark> tags, so question text can never
+# inject markup
+MATCH_START, MATCH_STOP = '\x02', '\x03'
+SEARCH_VECTOR = ("to_tsvector('english', coalesce(question, '') || ' ' || "
+                 "coalesce(answer, ''))")
+
+_fts_available = {}  # SQLite database url -> whether questions_fts exists
+
+
+def search_words(search_term):
+    # Only word characters reach the query, so no search syntax is injected
+    return re.findall(r'\w+', search_term.lower())
+
+
+def highlight(snippet):
+    return str(escape(snippet or '')).replace(
+        MATCH_START, '<mark>').replace(MATCH_STOP, '</mark>')
+
+
+def create_search_index():
+    '''
+    Idempotent; run once per database, not while serving. On PostgreSQL
+    the first run builds the GIN index, which takes a while on a large
+    bank and blocks writes to questions meanwhile (use
+    migrate_search_index.sql on a live database).
+    '''
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        db.session.execute(text(
+            'CREATE INDEX IF NOT EXISTS ix_questions_search '
+            'ON questions USING gin (%s)' % SEARCH_VECTOR))
+    elif dialect == 'sqlite':
+        db.session.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS questions_fts USING "
+            "fts5(question, answer, content='questions', "
+            "content_rowid='id')"))
+        db.session.execute(text('''
+            CREATE TRIGGER IF NOT EXISTS questions_fts_ai
+            AFTER INSERT ON questions BEGIN
+                INSERT INTO questions_fts(rowid, question, answer)
+                VALUES (new.id, new.question, new.answer);
+            END'''))
+        db.session.execute(text('''
+            CREATE TRIGGER IF NOT EXISTS questions_fts_ad
+            AFTER DELETE ON questions BEGIN
+                INSERT INTO questions_fts(questions_fts, rowid, question,
+                                          answer)
+                VALUES ('delete', old.id, old.question, old.answer);
+            END'''))
+        db.session.execute(text('''
+            CREATE TRIGGER IF NOT EXISTS questions_fts_au
+            AFTER UPDATE ON questions BEGIN
+                INSERT INTO questions_fts(questions_fts, rowid, question,
+                                          answer)
+                VALUES ('delete', old.id, old.question, old.answer);
+                INSERT INTO questions_fts(rowid, question, answer)
+                VALUES (new.id, new.question, new.answer);
+            END'''))
+        # Re-index in case questions was recreated under the FTS table
+        db.session.execute(text(
+            "INSERT INTO questions_fts(questions_fts) VALUES ('rebuild')"))
+    db.session.commit()
+    _fts_available.pop(str(db.engine.url), None)
+
+
+def has_fts_table():
+    # Read once per process and database; a schema lookup, never DDL
+    url = str(db.engine.url)
+    if url not in _fts_available:
+        _fts_available[url] = db.session.execute(text(
+            "SELECT count(*) FROM sqlite_master "
+            "WHERE name = 'questions_fts'")).scalar() > 0
+    return _fts_available[url]
+
+
+@click.command('create-search-index')
+@with_appcontext
+def create_search_index_command():
+    """Create the full-text search index (FTS5 table on SQLite)."""
+    create_search_index()
+    click.echo('Search index ready')
+
+
+def search_questions(search_term, category=None, page=1, per_page=10):
+    '''
+    Returns (page of question dicts, best match first, each with a
+    'snippet': the question as HTML with the matched words in <mark>,
+    total number of matches)
+    '''
+    words = search_words(search_term)
+    if not words:
+        return [], 0
+    params = {'category': category, 'limit': per_page,
+              'offset': (page - 1) * per_page}
+    category_filter = ('AND category = :category'
+                       if category is not None else '')
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        params['query'] = ' & '.join(word + ':*' for word in words)
+        params['options'] = 'StartSel=%s, StopSel=%s, HighlightAll=TRUE' % (
+            MATCH_START, MATCH_STOP)
+        match = ("FROM questions WHERE %s @@ to_tsquery('english', :query) %s"
+                 % (SEARCH_VECTOR, category_filter))
+        # ts_headline is costly, so it only runs on the rows of this page
+        rows = db.session.execute(text('''
+            SELECT q.*, ts_headline('english', q.question,
+                                    to_tsquery('english', :query), :options)
+                AS snippet
+            FROM (SELECT *, ts_rank(%s, to_tsquery('english', :query))
+                      AS rank
+                  %s ORDER BY rank DESC, id LIMIT :limit OFFSET :offset) q
+            ORDER BY q.rank DESC, q.id''' % (SEARCH_VECTOR, match)), params)
+    elif dialect == 'sqlite' and has_fts_table():
+        params['query'] = ' '.join('"%s"*' % word for word in words)
+        params['start'], params['stop'] = MATCH_START, MATCH_STOP
+        match = ('''FROM questions_fts JOIN questions
+                     ON questions.id = questions_fts.rowid
+                 WHERE questions_fts MATCH :query %s''' % category_filter)
+        rows = db.session.execute(text('''
+            SELECT questions.*, highlight(questions_fts, 0, :start, :stop)
+                AS snippet
+            %s ORDER BY questions_fts.rank, questions.id
+            LIMIT :limit OFFSET :offset''' % match), params)
+    else:
+        query = Question.query.filter(
+            Question.question.ilike('%' + search_term + '%'))
+        if category is not None:
+            query = query.filter(Question.category == category)
+        total = query.count()
+        questions = query.order_by(Question.id).limit(per_page).offset(
+            params['offset']).all()
+        return [dict(question.format(), snippet=str(escape(question.question)))
+                for question in questions], total
+    results = [{
+        'id': row.id,
+        'question': row.question,
+        'answer': row.answer,
+        'category': row.category,
+        'difficulty': row.difficulty,
+        'snippet': highlight(row.snippet)
+    } for row in rows]
+    total = db.session.execute(
+        text('SELECT count(*) ' + match), params).scalar()
+    return results, total
@@ -80,7 +80,8 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(len(questions), 2)
 
     def test_post_question_with_bad_input(self):
-        res = self
+        res = (
+            self
             .client()
             .post(
                 '/api/questions',
@@ -88,6 +89,7 @@ class TriviaTestCase(unittest.TestCase):
                     "question": "What was Einsteins famous equation"
                 }
             )
+        )
         data = json.loads(res.data)
 
         self.assertEqual(res.status_code, 200)  # Ensure successful request
@@ -105,6 +107,41 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertTrue(data['success'])
 
+    def test_get_questions_by_page_and_cursor(self):
+        # 25 questions in total
+        with self.app.app_context():
+            self.db.session.add_all([
+                Question(question="Question %d" % i, answer="Answer",
+                         category=1, difficulty=1)
+                for i in range(24)])
+            self.db.session.commit()
+
+        res = self.client().get('/api/questions?page=3')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['questions']), 5)
+        self.assertEqual(data['total_questions'], 25)
+        self.assertIsNone(data['next_cursor'])
+
+        res = self.client().get('/api/questions?per_page=8')
+        data = json.loads(res.data)
+        self.assertEqual([q['id'] for q in data['questions']],
+                         list(range(1, 9)))
+        self.assertEqual(data['next_cursor'], 8)
+
+        res = self.client().get('/api/questions?per_page=8&after=8')
+        data = json.loads(res.data)
+        self.assertEqual([q['id'] for q in data['questions']],
+                         list(range(9, 17)))
+        self.assertEqual(data['next_cursor'], 16)
+
+    def test_get_questions_with_bad_per_page(self):
+        res = self.client().get('/api/questions?per_page=1000')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertFalse(data['success'])
+
     def test_get_categories(self):
         res = self.client().get('/api/categories')
         data = json.loads(res.data)
@@ -113,6 +150,54 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['success'])
         self.assertGreater(data['total_categories'], 0)
 
+    def test_get_categories_not_modified(self):
+        res = self.client().get('/api/categories')
+        etag = res.headers['ETag']
+
+        res = self.client().get('/api/categories',
+                                headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b'')
+
+        # Adding a category changes the list and its ETag
+        with self.app.app_context():
+            self.db.session.add(Category(type="Art"))
+            self.db.session.commit()
+        res = self.client().get('/api/categories',
+                                headers={'If-None-Match': etag})
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_categories'], 2)
+        self.assertNotEqual(res.headers['ETag'], etag)
+
+    def test_get_stats(self):
+        with self.app.app_context():
+            self.db.session.add_all([
+                Category(type="Art"),
+                Question(question="Q", answer="A", category=1, difficulty=5),
+                Question(question="Q", answer="A", category=1, difficulty=2)])
+            self.db.session.commit()
+
+        res = self.client().get('/api/stats')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_questions'], 3)
+        science, art = data['categories']
+        self.assertEqual(science['total_questions'], 3)
+        self.assertEqual(science['difficulty'],
+                         {"1": 0, "2": 2, "3": 0, "4": 0, "5": 1})
+        self.assertEqual(art['total_questions'], 0)
+
+        # Writes through the ORM and bulk imports both refresh the stats
+        self.client().delete('/api/questions/1')
+        self.client().post(
+            '/api/questions/import', content_type='text/csv',
+            data='question,answer,category,difficulty\nQ,A,2,3\n')
+        data = json.loads(self.client().get('/api/stats').data)
+        science, art = data['categories']
+        self.assertEqual(science['difficulty']['2'], 1)
+        self.assertEqual(art['difficulty']['3'], 1)
+
     def test_delete_question(self):
         res = self.client().delete('/api/questions/1')
         data = json.loads(res.data)
@@ -143,6 +228,88 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['success'])
         self.assertEqual(data['total_questions'], 1)
 
+    def test_import_and_export_questions(self):
+        lines = [
+            {"question": "Q1", "answer": "A1", "category": 1,
+             "difficulty": 1},
+            {"question": "Q2", "answer": "A2", "category": 1,
+             "difficulty": 9},
+            {"question": "Q3", "answer": "A3", "category": "1",
+             "difficulty": "2"},
+            {"question": "Q4", "answer": "A4", "category": 7,
+             "difficulty": 1}]
+        body = '\n'.join(json.dumps(line) for line in lines) + '\n{oops\n'
+        res = self.client().post('/api/questions/import?chunk_size=2',
+                                 data=body,
+                                 content_type='application/x-ndjson')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['imported'], 2)
+        self.assertEqual(data['rejected'], 3)
+        self.assertEqual([error['line'] for error in data['errors']],
+                         [2, 4, 5])
+
+        res = self.client().post(
+            '/api/questions/import', content_type='text/csv',
+            data='question,answer,category,difficulty\nQ5,"A, 5",1,3\n')
+        self.assertEqual(json.loads(res.data)['imported'], 1)
+
+        res = self.client().get('/api/questions/export')
+        exported = [json.loads(line) for line in
+                    res.get_data(as_text=True).splitlines()]
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        self.assertEqual([q['question'] for q in exported][1:],
+                         ['Q1', 'Q3', 'Q5'])
+        self.assertEqual(exported[-1]['answer'], 'A, 5')
+
+        res = self.client().get('/api/questions/export?format=csv')
+        self.assertEqual(res.get_data(as_text=True).splitlines()[0],
+                         'id,question,answer,category,difficulty')
+
+    def test_search_questions_ranked_with_snippets(self):
+        with self.app.app_context():
+            self.db.session.add_all([
+                Question(question="Which <b>band</b> recorded Abbey Road",
+                         answer="The Beatles", category=2, difficulty=1),
+                Question(question="Who painted the Mona Lisa",
+                         answer="Leonardo", category=2, difficulty=3),
+                Question(question="Which element is named after Alexander "
+                                  "the Great's tutor, or Alexandria",
+                         answer="None", category=3, difficulty=5)])
+            self.db.session.commit()
+
+        res = self.client().post('/api/questions/search',
+                                 json={"searchTerm": "alex"})
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_questions'], 2)
+        # Two matching words outrank one
+        self.assertEqual(data['questions'][0]['id'], 4)
+        self.assertIn('<mark>Alexander</mark>',
+                      data['questions'][1]['snippet'])
+
+        # Answers are searched too, and question text is escaped
+        res = self.client().post('/api/questions/search',
+                                 json={"searchTerm": "beatles"})
+        data = json.loads(res.data)
+        self.assertEqual(data['total_questions'], 1)
+        self.assertIn('&lt;b&gt;band&lt;/b&gt;',
+                      data['questions'][0]['snippet'])
+
+        res = self.client().post(
+            '/api/questions/search',
+            json={"searchTerm": "alex", "category": 1})
+        data = json.loads(res.data)
+        self.assertEqual(data['total_questions'], 1)
+        self.assertEqual(data['questions'][0]['id'], 1)
+
+        res = self.client().post(
+            '/api/questions/search',
+            json={"searchTerm": "alex", "page": 2, "per_page": 1})
+        data = json.loads(res.data)
+        self.assertEqual(data['total_questions'], 2)
+        self.assertEqual([q['id'] for q in data['questions']], [1])
+
     def test_search_questions_with_no_questions(self):
         res = self.client().post('/api/questions/search',
                                  json={"searchTerm": "Doesn't Exist"})
@@ -160,6 +327,116 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['success'])
         self.assertEqual(data['question']['id'], 1)
 
+    def test_play_skips_previous_questions(self):
+        with self.app.app_context():
+            self.db.session.add_all([
+                Question(question="Question %d" % i, answer="Answer",
+                         category=1, difficulty=1)
+                for i in range(99)])
+            self.db.session.commit()
+        # Only question 57 is left
+        previous = [i for i in range(1, 101) if i != 57]
+        res = self.client().post(
+            '/api/play',
+            json={"quizCategory": 1, "previousQuestions": previous})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['question']['id'], 57)
+
+        res = self.client().post(
+            '/api/play',
+            json={"quizCategory": 1,
+                  "previousQuestions": list(range(1, 101))})
+        data = json.loads(res.data)
+        self.assertFalse(data['question'])
+
+    def test_play_is_random_within_a_clustered_category(self):
+        # Category 2 holds ids 2..7 of a 1000 question bank
+        with self.app.app_context():
+            self.db.session.add(Category(type="Art"))
+            self.db.session.add_all([
+                Question(question="Art %d" % i, answer="Answer",
+                         category=2, difficulty=1) for i in range(6)])
+            self.db.session.add_all([
+                Question(question="Science %d" % i, answer="Answer",
+                         category=1, difficulty=1) for i in range(993)])
+            self.db.session.commit()
+        orders = []
+        for _ in range(3):
+            previous = []
+            for _ in range(6):
+                res = self.client().post('/api/play', json={
+                    "quizCategory": 2, "previousQuestions": previous})
+                previous.append(json.loads(res.data)['question']['id'])
+            orders.append(previous)
+
+        self.assertTrue(all(sorted(order) == list(range(2, 8))
+                            for order in orders))
+        # Sequential order three times running has odds of 1 in 720**3
+        self.assertTrue(any(order != sorted(order) for order in orders))
+        # Every question leads a quiz now and then: with uniform picks the
+        # odds of one never coming first in 60 quizzes are about 1 in 10**4
+        first = set()
+        for _ in range(60):
+            res = self.client().post('/api/play', json={"quizCategory": 2})
+            first.add(json.loads(res.data)['question']['id'])
+        self.assertEqual(first, set(range(2, 8)))
+
+    def test_quiz_deals_each_question_once(self):
+        with self.app.app_context():
+            self.db.session.add_all([
+                Question(question="Question %d" % i, answer="Answer",
+                         category=i % 2 + 1, difficulty=1)
+                for i in range(20)])
+            self.db.session.commit()
+        res = self.client().post('/api/quizzes', json={"quizCategory": 1})
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_questions'], 11)
+
+        seen = []
+        for remaining in range(10, -1, -1):
+            res = self.client().post(
+                '/api/quizzes/%s/next' % data['quiz_id'])
+            question = json.loads(res.data)
+            self.assertEqual(question['remaining'], remaining)
+            self.assertEqual(question['question']['category'], 1)
+            seen.append(question['question']['id'])
+        self.assertEqual(len(set(seen)), 11)
+
+        res = self.client().post('/api/quizzes/%s/next' % data['quiz_id'])
+        self.assertFalse(json.loads(res.data)['question'])
+
+    def test_quiz_deck_is_sampled_in_the_database(self):
+        with self.app.app_context():
+            self.db.session.add_all([
+                Question(question="Question %d" % i, answer="Answer",
+                         category=i % 2 + 1, difficulty=1)
+                for i in range(20)])
+            self.db.session.commit()
+            in_category = set(q.id for q in
+                              Question.query.filter_by(category=1))
+            sampled = Question.sample_ids(1, 4)
+            self.assertEqual(len(sampled), 4)
+            self.assertEqual(len(set(sampled)), 4)
+            self.assertTrue(set(sampled) <= in_category)
+            self.assertEqual(set(Question.sample_ids(1)), in_category)
+
+    def test_quiz_not_found(self):
+        res = self.client().post('/api/quizzes/missing/next')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertFalse(data['success'])
+
+    def test_play_with_bad_category(self):
+        res = self.client().post('/api/play', json={"quizCategory": "Art"})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertFalse(data['success'])
+
     def test_play_with_no_questions(self):
         res = self.client().post('/api/play', json={"quizCategory": 2})
         data = json.loads(res.data)
@@ -0,0 +1,58 @@
+'''
+Cost of check_permissions for tokens with large permission lists.
+
+    python bench_permissions.py
+
+Compares the old linear scan of payload['permissions'] with a lookup in
+the PermissionSet that requires_auth compiles once per token and keeps in
+the token cache. The required permission is never granted, the worst case
+for the scan.
+'''
+import timeit
+
+from fsnd_auth import PermissionSet
+
+from src.auth.auth import check_permissions
+
+SIZES = [10, 100, 1000, 10000]
+REQUIRED = 'patch:drinks'
+REPEAT = 5
+NUMBER = 2000
+
+
+def linear_check(permission, payload):
+    return permission in payload['permissions']
+
+
+def best_us(statement):
+    # Best of REPEAT runs, in microseconds per call
+    return min(timeit.repeat(statement, number=NUMBER,
+                             repeat=REPEAT)) / NUMBER * 1e6
+
+
+def main():
+    print('%8s %12s %12s %12s %12s' % (
+        'grants', 'scan (us)', 'compile (us)', 'has (us)', 'check (us)'))
+    for size in SIZES:
+        payload = {'permissions': ['get:resource-%d' % i
+                                   for i in range(size)] + ['*:menu']}
+        granted = PermissionSet.from_payload(payload)
+        assert not granted.has(REQUIRED) and granted.has('get:menu')
+        print('%8d %12.2f %12.2f %12.2f %12.2f' % (
+            size,
+            best_us(lambda: linear_check(REQUIRED, payload)),
+            best_us(lambda: PermissionSet.from_payload(payload)),
+            best_us(lambda: granted.has(REQUIRED)),
+            best_us(lambda: _denied(payload, granted))))
+
+
+def _denied(payload, granted):
+    try:
+        check_permissions(REQUIRED, payload, granted=granted)
+    except Exception:
+        return True
+    return False
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,6 @@
 import os
 from flask import Flask, request, jsonify, abort
 from sqlalchemy import exc
-import json
 from flask_cors import CORS, cross_origin
 
 from .database.models import db, db_drop_and_create_all, setup_db, Drink
@@ -18,6 +17,11 @@ CORS(app)
 '''
 # db_drop_and_create_all()
 
+def valid_recipe(recipe):
+    # A recipe is a list of ingredients, each with at least a color and parts
+    return isinstance(recipe, list) and all(
+        isinstance(r, dict) and 'color' in r and 'parts' in r for r in recipe)
+
 ## ROUTES
 '''
 @DONE implement endpoint
@@ -63,7 +67,6 @@ def retrieve_drinks_detail(jwt):
     long_drinks = []
     for d in drinks:
         long_drinks.append(d.long())
-        # Issue is being caused because posted items use single quotes in recipe string rather than double quotes
     body['success'] = True
     body['drinks'] = long_drinks
     return jsonify(body)
@@ -82,10 +85,12 @@ def retrieve_drinks_detail(jwt):
 @requires_auth('post:drinks')
 def post_drink(jwt):
     body = {}
+    if not valid_recipe((request.get_json(silent=True) or {}).get('recipe')):
+        abort(422)
     try:
         title = request.json['title']
         # recipe = str([{"color": "sienna", "name":"Angel's Envy Rye", "parts":5}, {"color": "peru", "name":"Sweet Vermouth", "parts":1}])
-        recipe = json.dumps(request.json['recipe'])
+        recipe = request.json['recipe']
         new_drink = Drink(title = title, recipe = recipe)
         db.session.add(new_drink)
         db.session.commit()
@@ -117,6 +122,8 @@ def patch_drink(jwt, id):
     drink = Drink.query.filter(Drink.id == id).one_or_none()
     if drink is None:
         abort(404)
+    elif 'recipe' in (req or {}) and not valid_recipe(req['recipe']):
+        abort(422)
     else:
         try:
             # for attr, value in req.items():
@@ -124,7 +131,7 @@ def patch_drink(jwt, id):
             if 'title' in req:
                 drink.title = str(req.get('title'))
             if 'recipe' in req:
-                drink.recipe = json.dumps(req.get('recipe'))
+                drink.recipe = req.get('recipe')
             drink.update()
                 # drink.commit()
             body['success'] = True
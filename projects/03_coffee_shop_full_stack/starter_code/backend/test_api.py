@@ -0,0 +1,107 @@
+import os
+import json
+import tempfile
+import time
+import unittest
+
+from jose import jwt
+from fsnd_auth import SecretKeyProvider
+
+# The API binds its database at import; point it at a throwaway file first
+import src.database.models as models
+fd, TEST_DATABASE = tempfile.mkstemp(suffix='.db')
+os.close(fd)
+models.database_path = 'sqlite:///' + TEST_DATABASE
+
+from src.api import app
+from src.auth import auth
+from src.database.models import db, Drink
+
+SECRET = 'test-secret'
+RECIPE = [{'color': 'brown', 'name': 'coffee', 'parts': 3},
+          {'color': 'white', 'name': 'milk', 'parts': 1}]
+
+
+def make_token(permissions):
+    return jwt.encode({'iss': 'https://%s/' % auth.AUTH0_DOMAIN,
+                       'aud': auth.API_AUDIENCE, 'sub': 'barista',
+                       'exp': time.time() + 600,
+                       'permissions': permissions}, SECRET, algorithm='HS256')
+
+
+class CoffeeShopTestCase(unittest.TestCase):
+    """This class represents the coffee shop test case"""
+
+    def setUp(self):
+        """Define test variables and initialize app."""
+        # Sign test tokens with a shared secret instead of Auth0's keys
+        self.keys = auth.auth.keys
+        auth.auth.keys = SecretKeyProvider(SECRET)
+        auth.token_cache.clear()
+        self.client = app.test_client
+        self.headers = {'Authorization': 'Bearer ' + make_token(
+            ['post:drinks', 'patch:drinks'])}
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            db.session.add(Drink(title='Flat White', recipe=RECIPE))
+            db.session.commit()
+
+    def tearDown(self):
+        """Executed after reach test"""
+        auth.auth.keys = self.keys
+
+    def test_short_recipe_keeps_color_and_parts(self):
+        drink = Drink(id=7, title='Latte', recipe=RECIPE)
+
+        self.assertEqual(drink.short(), {
+            'id': 7, 'title': 'Latte',
+            'recipe': [{'color': 'brown', 'parts': 3},
+                       {'color': 'white', 'parts': 1}]})
+        # Changes to the recipe show up in the next short() call
+        drink.recipe[0]['parts'] = 2
+        self.assertEqual(drink.short()['recipe'][0]['parts'], 2)
+        drink.recipe = RECIPE[1:]
+        self.assertEqual(drink.short()['recipe'],
+                         [{'color': 'white', 'parts': 1}])
+
+    def test_get_drinks(self):
+        res = self.client().get('/drinks')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertEqual(data['drinks'][0]['recipe'][1],
+                         {'color': 'white', 'parts': 1})
+
+    def test_post_drink(self):
+        res = self.client().post('/drinks', headers=self.headers,
+                                 json={'title': 'Mocha', 'recipe': RECIPE})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertEqual(data['drinks']['recipe'], RECIPE)
+
+    def test_422_for_a_malformed_recipe(self):
+        for recipe in [{'color': 'brown', 'parts': 1}, [{'color': 'brown'}],
+                       ['coffee'], None]:
+            res = self.client().post('/drinks', headers=self.headers,
+                                     json={'title': 'Bad', 'recipe': recipe})
+            self.assertEqual(res.status_code, 422)
+            self.assertFalse(json.loads(res.data)['success'])
+
+        res = self.client().patch('/drinks/1', headers=self.headers,
+                                  json={'recipe': [{'parts': 1}]})
+        self.assertEqual(res.status_code, 422)
+        with app.app_context():
+            self.assertEqual(Drink.query.get(1).recipe, RECIPE)
+
+
+def tearDownModule():
+    os.remove(TEST_DATABASE)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
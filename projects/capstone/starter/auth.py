@@ -0,0 +1,32 @@
+import os
+from fsnd_auth import (Auth, JWKSKeyProvider, PEMKeyProvider,
+                       SecretKeyProvider)
+
+# The key source is picked from the environment (see setup.sh):
+#   JWT_SECRET           HS256 tokens signed with a shared secret
+#   JWT_PUBLIC_KEY_FILE  RS256 tokens checked against a local PEM key
+#   AUTH0_DOMAIN         RS256 tokens checked against the tenant's JWKS
+KEY_SOURCES = ('JWT_SECRET', 'JWT_PUBLIC_KEY_FILE', 'AUTH0_DOMAIN')
+
+def check_settings():
+  missing = [] if os.environ.get('API_AUDIENCE') else ['API_AUDIENCE']
+  if not any(os.environ.get(name) for name in KEY_SOURCES):
+    missing.append('one of ' + ', '.join(KEY_SOURCES))
+  if missing:
+    raise RuntimeError('auth.py needs %s set in the environment '
+                       '(see setup.sh)' % ' and '.join(missing))
+
+def key_provider():
+  if os.environ.get('JWT_SECRET'):
+    return SecretKeyProvider(os.environ['JWT_SECRET'])
+  if os.environ.get('JWT_PUBLIC_KEY_FILE'):
+    return PEMKeyProvider(os.environ['JWT_PUBLIC_KEY_FILE'])
+  return JWKSKeyProvider.for_auth0(os.environ['AUTH0_DOMAIN'])
+
+def issuer():
+  domain = os.environ.get('AUTH0_DOMAIN')
+  return os.environ.get('JWT_ISSUER') or (domain and 'https://%s/' % domain)
+
+check_settings()
+auth = Auth(key_provider(), os.environ['API_AUDIENCE'], issuer=issuer())
+requires_auth = auth.requires_auth
@@ -1 +1,4 @@
-
+# Auth configuration read by auth.py; set one of AUTH0_DOMAIN,
+# JWT_PUBLIC_KEY_FILE or JWT_SECRET
+export AUTH0_DOMAIN='bjb.auth0.com'
+export API_AUDIENCE='capstone'